@@ -0,0 +1,100 @@
+"""Hard and soft iron calibration of the drone's magnetometer.
+
+   Turning on the spot, the horizontal field should trace a circle
+   around zero. Iron on the drone shifts it (hard iron) and squeezes it
+   into an ellipse (soft iron). Samples are streamed in during a spin
+   and an ellipse is fitted to them by least squares (Halir and Flusser's
+   stable form of Fitzgibbon's direct fit). Its centre is the hard iron
+   offset, and the matrix mapping it back onto a circle is the soft iron
+   correction."""
+import math
+import numpy as np
+
+MIN_SAMPLES = 20 # Fewer than this never give a usable fit
+BINS = 36        # Heading sectors for judging how much of the circle was seen
+
+def fit_ellipse(x, y):
+    """Conic coefficients (a, b, c, d, e, f) of the ellipse
+       a x^2 + b xy + c y^2 + d x + e y + f = 0 closest to the points,
+       None if they are not spread around an ellipse."""
+    D1 = np.column_stack((x * x, x * y, y * y))
+    D2 = np.column_stack((x, y, np.ones_like(x)))
+    S1, S2, S3 = D1.T.dot(D1), D1.T.dot(D2), D2.T.dot(D2)
+    try:
+        T = -np.linalg.solve(S3, S2.T)
+        M = S1 + S2.dot(T)
+        M = np.array([M[2] / 2.0, -M[1], M[0] / 2.0]) # Inverse of the constraint 4ac - b^2 = 1
+        vals, vecs = np.linalg.eig(M)
+    except np.linalg.LinAlgError: return None
+    vecs = np.real(vecs)
+    ellipse = 4 * vecs[0] * vecs[2] - vecs[1]**2 > 0
+    if not ellipse.any(): return None
+    a1 = vecs[:, np.argmax(ellipse)]
+    if a1[0] < 0: a1 = -a1 # Eigenvectors come either sign, keep a, c > 0
+    return np.concatenate((a1, T.dot(a1)))
+
+class CompassCalibration:
+    """Collects magnetometer x, y (and the drone's yaw, to know how far
+       it turned) packet by packet, then fits the correction:
+         offset - hard iron, the centre of the ellipse
+         matrix - soft iron, maps (raw - offset) onto a circle
+         radius - of that circle, the horizontal field strength
+         rms    - radial error of the corrected samples, share of radius
+         coverage - share of heading sectors holding corrected samples"""
+
+    def __init__(self, size=4096):
+        self.__samples = np.zeros((size, 2))
+        self.__count = 0
+        self.__last_yaw = None
+        self.turned = 0.0 # Degrees turned while collecting, either way
+        self.offset, self.matrix = np.zeros(2), np.eye(2)
+        self.radius = self.rms = self.coverage = None
+
+    def add(self, x, y, yaw=None):
+        """One magnetometer reading; keeps the latest size of them."""
+        self.__samples[self.__count % len(self.__samples)] = x, y
+        self.__count += 1
+        if yaw is not None:
+            if self.__last_yaw is not None:
+                self.turned += abs((yaw - self.__last_yaw + 180.0) % 360.0 - 180.0)
+            self.__last_yaw = yaw
+
+    def __len__(self):
+        return min(self.__count, len(self.__samples))
+
+    def fit(self):
+        """Fits the collected samples, returns whether an ellipse was
+           found. The correction only changes when it was."""
+        if len(self) < MIN_SAMPLES: return False
+        pts = self.__samples[:len(self)]
+
+        # Fit in normalized units, it keeps the scatter matrices sane
+        mean, scale = pts.mean(axis=0), pts.std(axis=0).max()
+        if not scale > 0: return False
+        conic = fit_ellipse(*((pts - mean) / scale).T)
+        if conic is None: return False
+        a, b, c, d, e, f = conic
+        Q = np.array([[a, b / 2.0], [b / 2.0, c]])
+        centre = -0.5 * np.linalg.solve(Q, [d, e])
+        k = centre.dot(Q).dot(centre) - f
+        if not k > 0: return False
+
+        # (p - centre)' (Q / k) (p - centre) = 1; its square root maps the
+        #  ellipse onto the unit circle, scaled back to keep the same area
+        vals, vecs = np.linalg.eigh(Q / k)
+        if not (vals > 0).all(): return False
+        radius = (vals[0] * vals[1])**-0.25
+        self.offset = mean + centre * scale
+        self.matrix = vecs.dot(np.diag(np.sqrt(vals))).dot(vecs.T) * radius
+        self.radius = radius * scale
+
+        corrected = (pts - self.offset).dot(self.matrix.T)
+        length = np.hypot(corrected[:, 0], corrected[:, 1])
+        self.rms = math.sqrt(np.mean((length - self.radius)**2)) / self.radius
+        sector = (np.arctan2(corrected[:, 1], corrected[:, 0]) + math.pi) * BINS / (2 * math.pi)
+        self.coverage = len(np.unique(np.minimum(sector.astype(int), BINS - 1))) / float(BINS)
+        return True
+
+    def correct(self, x, y):
+        """Calibrated (x, y) of a raw reading."""
+        return self.matrix.dot(np.subtract((x, y), self.offset))
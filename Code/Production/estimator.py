@@ -0,0 +1,103 @@
+import geo, math
+import numpy as np
+
+class StateEstimator:
+    """Fuses every NavData packet into a current estimate of position,
+       velocity, heading and altitude of an AR Drone 2.0, in O(1) per
+       packet:
+         position/velocity - Kalman filter on (east, north, v_east,
+                             v_north) in meters around the first GPS fix,
+                             driven by the drone's body velocity and
+                             corrected by every new GPS fix
+         heading           - complementary filter: the drone's yaw
+                             (integrated gyro) for short term changes,
+                             the magnetometer heading against its drift
+         altitude          - low-pass of the altimeter"""
+    def __init__(self, gps_sigma=3.0, vel_sigma=0.1, acc_sigma=0.5,
+            mag_weight=0.02, alt_weight=0.5):
+        """gps_sigma/vel_sigma: measurement noise in m and m/s,
+           acc_sigma: unmodelled acceleration in m/s^2, mag_weight and
+           alt_weight: share of each measurement in the filtered value."""
+        self.__R_GPS = np.eye(2) * gps_sigma**2
+        self.__R_VEL = np.eye(2) * vel_sigma**2
+        self.__ACC_VAR = acc_sigma**2
+        self.__MAG_WEIGHT = mag_weight
+        self.__ALT_WEIGHT = alt_weight
+        self.__H_GPS = np.array([[1.0, 0, 0, 0], [0, 1.0, 0, 0]])
+        self.__H_VEL = np.array([[0, 0, 1.0, 0], [0, 0, 0, 1.0]])
+
+        self.__x = np.zeros(4)          # east, north, v_east, v_north
+        self.__P = np.eye(4) * 1e6      # Unknown until the first fix
+        self.__enu = None               # Projection around the first fix
+        self.__last_gps = None
+        self.__last_stamp = None
+        self.__last_yaw = None
+        self.__heading = None
+        self.__alt = None
+        self.updates = 0
+
+    def update(self, stamp, gps, vel, yaw, mag_heading, alt):
+        """One NavData packet: local time (s), [lat, lon], body velocity
+           [forward, right, ...] in mm/s, drone yaw and magnetometer
+           heading (degrees, 0 as North) and altitude in m."""
+        self.updates += 1
+        self.__update_heading(yaw, mag_heading)
+        if self.__alt is None: self.__alt = alt
+        else: self.__alt += self.__ALT_WEIGHT * (alt - self.__alt)
+
+        # Predict position with constant velocity
+        dt = 0.0 if self.__last_stamp is None else min(max(stamp - self.__last_stamp, 0.0), 0.5)
+        self.__last_stamp = stamp
+        if dt:
+            F = np.eye(4)
+            F[0, 2] = F[1, 3] = dt
+            G = np.array([0.5 * dt**2, 0.5 * dt**2, dt, dt])
+            self.__x = F.dot(self.__x)
+            self.__P = F.dot(self.__P).dot(F.T) + np.diag(G**2) * self.__ACC_VAR
+
+        # Body velocity rotated into east/north
+        h = math.radians(self.__heading)
+        fwd, rgt = vel[0] / 1000.0, vel[1] / 1000.0
+        self.__correct(self.__H_VEL, self.__R_VEL, np.array([
+                fwd * math.sin(h) + rgt * math.cos(h),
+                fwd * math.cos(h) - rgt * math.sin(h)]))
+
+        # GPS only corrects when it reports a new, real fix
+        lat, lon = gps[0], gps[1]
+        if not geo.is_fix(lat, lon) or (lat, lon) == self.__last_gps: return
+        self.__last_gps = (lat, lon)
+        if self.__enu is None:
+            self.__enu = geo.LocalProjection(lat, lon)
+            self.__x[:2], self.__P[:2, :2] = 0.0, self.__R_GPS
+        self.__correct(self.__H_GPS, self.__R_GPS, np.array(self.__enu.to_local(lat, lon)))
+
+    def __update_heading(self, yaw, mag_heading):
+        """Gyro yaw carries the heading, the magnetometer pulls it back."""
+        if self.__heading is None: self.__heading = mag_heading
+        else:
+            turned = (yaw - self.__last_yaw + 180.0) % 360.0 - 180.0
+            self.__heading += turned
+            drift = (mag_heading - self.__heading + 180.0) % 360.0 - 180.0
+            self.__heading = (self.__heading + self.__MAG_WEIGHT * drift) % 360.0
+        self.__last_yaw = yaw
+
+    def __correct(self, H, R, z):
+        """Kalman measurement update."""
+        S = H.dot(self.__P).dot(H.T) + R
+        K = self.__P.dot(H.T).dot(np.linalg.inv(S))
+        self.__x = self.__x + K.dot(z - H.dot(self.__x))
+        self.__P = (np.eye(4) - K.dot(H)).dot(self.__P)
+
+    def state(self):
+        """Current estimate, None before the first GPS fix:
+           gps [lat, lon], deg (heading, 0 as North), alt (m),
+           pos [east, north] and vel [east, north] in m and m/s,
+           sigma (m, position uncertainty)."""
+        if self.__enu is None: return None
+        x, P = self.__x.copy(), self.__P
+        return {"gps": list(self.__enu.to_gps(x[0], x[1])),
+                "deg": self.__heading,
+                "alt": self.__alt,
+                "pos": x[:2],
+                "vel": x[2:],
+                "sigma": math.sqrt(max(P[0, 0], P[1, 1]))}
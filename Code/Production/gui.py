@@ -211,6 +211,15 @@ class GUI(object):
         self.test_button.config(width=self.button_width,font=self.button_text)
         self.test_button.grid(row=1, column=1)
 
+        # Metrics button
+        self.metrics_button = tk.Button(
+                self.controllerside,
+                text="Metrics",
+                highlightbackground=self.control_color_back,
+                command=self.d_metrics)
+        self.metrics_button.config(width=self.button_width,font=self.button_text)
+        self.metrics_button.grid(row=0, column=2)
+
         # Radio buttons
         self.radios = []
         radio_texts = ["Waypoint", "Rectangle"]
@@ -268,10 +277,11 @@ class GUI(object):
 
     def camstat(self):
         cam_img = self.camera.getFrame()
-        cam_img = Image.fromarray(cam_img)
-        cam_img = ImageTk.PhotoImage(cam_img)
-        self.panel_cam.config(image = cam_img)
-        self.panel_cam.cam_img = cam_img
+        if cam_img is not None: # keep showing the last frame otherwise
+            cam_img = Image.fromarray(cam_img)
+            cam_img = ImageTk.PhotoImage(cam_img)
+            self.panel_cam.config(image = cam_img)
+            self.panel_cam.cam_img = cam_img
         self.root.after(100, self.camstat)
 
     def altstat(self):
@@ -402,7 +412,8 @@ class GUI(object):
         d = self.get_l(self.clk_arr[0][0], self.clk_arr[1][1])
 
         self.clear_slctns()
-        self.navigator.gen_waypnts([a, b, c, d])
+        try: self.navigator.gen_waypnts([a, b, c, d])
+        except RuntimeError as e: print ">>> {}".format(e)
         self.rend_path()
         self.clk_arr = []
 
@@ -430,6 +441,7 @@ class GUI(object):
 
     def shutdown(self):
         self.controller_manual.set()
+        if self.navigator != None: self.navigator.stop()
         self.drone.shutdown()
 
     def d_hover(self):
@@ -506,6 +518,9 @@ class GUI(object):
     def d_blue(self):
         if self.camera != None: self.camera.tog_colors()
 
+    def d_metrics(self):
+        if self.camera != None: self.camera.tog_metrics()
+
     def d_test(self):
         return None
 
@@ -538,6 +553,7 @@ class GUI(object):
         self.camera_event.set()
         if self.camera != None: self.camera.cam_thread.join()
         if self.camera != None: self.camera.release()
+        if self.navigator != None: self.navigator.stop()
         if self.drone != None: self.drone.shutdown
         self.root.destroy() # Discard Main window object
         print "Exiting GUI"
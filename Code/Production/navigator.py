@@ -1,5 +1,6 @@
-import itertools, ps_drone, time, math
-from threading import Thread
+import compass, coverage, geo, ps_drone, route, time, math, trees
+from threading import Event
+from estimator import StateEstimator
 from collections import deque
 import numpy as np
 from scipy import stats
@@ -15,12 +16,28 @@ class Navigator:
         self.__SOFT_TURN = 0.1
         self.__HARD_TURN = 0.3
         self.__DEF_SPD   = 0.3
+        self.__CAM_FOV   = 64.0 # Camera field of view across a survey pass, degrees
+        self.__OVERLAP   = 0.3  # Share of an image seen again from the next pass
+        self.__MIN_ALT   = 2.0  # Altitude assumed for pass spacing when lower, m
         self.__SAMP_NUM  = 150
         self.__SAMP_TIME = 0.005
-        self.__mag_avg = [-14, 13] # Manually calculated normalization of magnetometer x, y
-        self.__mag_acc = 6  # Points to record during calibration
+        self.__MAG_TURN  = 400.0 # Degrees to spin for magnetometer calibration, a full turn and some
+        self.__MAG_RMS   = 0.1   # Worst accepted radial error of a calibration, share of field
+        self.__MAG_COVER = 0.9   # Least accepted share of headings seen by a calibration
+        self.__mag_cal = (np.array([-14.0, 13.0]), np.eye(2)) # Hard iron offset, soft iron matrix of x, y; manual until calibrated
+        self.__mag_fit = None # CompassCalibration collecting samples during a spin
         self.waypoints = deque() # public for gui route drawing
-        self.__samples = deque(maxlen = self.__SAMP_NUM) # Sampling queue
+
+        # Sampling ring buffer - one row per sample, columns of every stat
+        self.__STAT_NAMES = ["vel", "acc", "gyr", "gps", "alt", "mag", "deg", "pry", "mfu"]
+        self.__STAT_SIZES = [ 3,     3,     3,     2,     1,     2,     1,     3,     1  ]
+        self.__STAT_COLS = np.cumsum([0] + self.__STAT_SIZES)
+        self.__COL = dict((name, slice(self.__STAT_COLS[i], self.__STAT_COLS[i + 1]))
+                for i, name in enumerate(self.__STAT_NAMES))
+        self.__samples = np.zeros((self.__SAMP_NUM, self.__STAT_COLS[-1]))
+        self.__samp_count = 0 # Samples written so far, the buffer's generation
+        self.__samp_time = 0.0 # When the last sample was written
+        self.__stopped = Event() # Set by stop(), no samples come after it
 
         # NavData packages required by the whole program, even if
         #  not the Navigator object itself.
@@ -30,7 +47,15 @@ class Navigator:
         self.__tar_gps = None # Next target's gps coordinate
         self.__tar_dist = 0.0
         self.__tar_angle = 0.0
-        self.__stats = {}   # Stats dict
+        self.__tar_xtrack = 0.0 # Cross-track error, positive right of the leg
+        self.__leg = (None, None) # Target and local start of the current leg
+        self.__projected = {} # Local coordinates of every waypoint seen
+        self.__stats = {}   # Stats dict, a snapshot replaced on every update
+        self.__stats_gen = -1 # Sample generation the snapshot was made from
+        self.__estimator = StateEstimator() # Current state, source of moves
+        self.__home = None # First GPS fix, origin of the navigation plane
+        self.__enu = None  # Local tangent plane around home, all navigation maths is planar
+        self.trees = None # TreeRegistry of the orchard, see load_trees
 
         # Initialize sensor data transmissions
         print ">>> Initializing NavData"
@@ -39,68 +64,100 @@ class Navigator:
         self.__drone.getNDpackage(self.__REQ_PACKS)
         time.sleep(0.1)
 
-        # Start taking sensor data
+        # Start taking sensor data, the drone hands over every package
         print ">>> Populating data queue..."
-        self.__sensors = Thread(target=self.__sensors_collect, args=())
-        self.__sensors.daemon = True
-        self.__sensors.start()
+        self.__drone.addNavDataCallback(self.__on_navdata)
         time.sleep(self.__SAMP_TIME * self.__SAMP_NUM * 1.5)
 
-        # Get current GPS for "home" location
-        print ">>> Obtaining Home coordinate"
-        self.__set_stats()
-        self.__home = list(self.__stats["gps"])
+        # Home is the first GPS fix, nothing is planned or flown before it
+        if self.__enu == None: print ">>> Waiting for a GPS fix to set Home"
 
         # Done initializing
         print ">>> NAVIGATOR READY"
 
     # Sensor Data Calculation Functions
-    def __sensors_collect(self):
-        """Continuously collects sensor data"""
-        while True:
-            self.__samples.append(self.__get_stats())
-            time.sleep(self.__SAMP_TIME)
+    def __on_navdata(self, navdata, count, stamp):
+        """NavData callback of the drone: writes the package's sensor
+           data straight into the next ring buffer row, then feeds the
+           state estimator. The row is filled before the count exposes
+           it."""
+        for package in self.__REQ_PACKS:
+            if package not in navdata: return
+        demo, magneto = navdata["demo"], navdata["magneto"]
+        row, col = self.__samples[self.__samp_count % self.__SAMP_NUM], self.__COL
+        row[col["vel"]] = demo[4] # xyz velocity mm/s
+        row[col["acc"]] = navdata["raw_measures"][0]
+        row[col["gyr"]] = navdata["raw_measures"][1]
+        row[col["gps"]] = navdata["gps"][:2] # not using altitude value
+        row[col["alt"]] = navdata["altitude"][0] / 1000.0 # meters
+        row[col["pry"]] = demo[2] # pitch roll yaw
+        row[col["mfu"]] = magneto[6]
+
+        # Turn calibrated magnetometer data into heading (radians w/ 0 as East)
+        offset, matrix = self.__mag_cal
+        raw_x, raw_y = magneto[0][0] - offset[0], magneto[0][1] - offset[1]
+        mag_x = matrix[0, 0] * raw_x + matrix[0, 1] * raw_y
+        mag_y = matrix[1, 0] * raw_x + matrix[1, 1] * raw_y
+        row[col["mag"]] = mag_x, mag_y
+        deg = -1 * math.atan2(mag_y, mag_x)
+        row[col["deg"]] = deg
+
+        fit = self.__mag_fit
+        if fit != None: fit.add(magneto[0][0], magneto[0][1], demo[2][2])
+
+        gps = navdata["gps"]
+        if self.__enu == None and geo.is_fix(gps[0], gps[1]):
+            self.__home = [gps[0], gps[1]]
+            self.__enu = geo.LocalProjection(gps[0], gps[1])
+
+        self.__samp_count += 1
+        self.__samp_time = stamp
+        self.__estimator.update(stamp, row[col["gps"]], row[col["vel"]],
+                row[col["pry"]][2], ((-deg * 180 / math.pi) + 450) % 360,
+                row[col["alt"]][0])
+
+    def stop(self):
+        """Stops taking sensor data. get_nav() and get_state() keep
+           returning the last values."""
+        self.__drone.removeNavDataCallback(self.__on_navdata)
+        self.__stopped.set()
 
     def __set_stats(self):
-        """Preprocessing of stats queue to reduce variation"""
-        # 1-to-1 lists used in for loops
-        vel = []
-        acc, gyr, gps = [], [], []
-        alt, mag, deg = [], [], []
-        pry, mfu, out = [], [], []
-        stat_names = ["vel", "acc", "gyr", "gps", "alt", "mag", "deg", "pry", "mfu"]
-        stat_lists = [ vel,   acc,   gyr,   gps,   alt,   mag,   deg ,  pry ,  mfu ]
-
-        # Build lists to be analyzed
-        for item in list(self.__samples):
-            for i in range(len(stat_names)):
-                stat_lists[i].append(item[stat_names[i]])
-
-        # Remove outliers
-        for stat in stat_lists:
-            out.append(list(itertools.compress(
-                stat, self.__not_outlier(np.array(stat)))))
-
-        # Check that lists are populated
-        for i in range(len(stat_lists)):
-            if out[i]: stat_lists[i] = out[i]
-
-        # Average the remainder of the lists
-        for i in range(len(stat_lists)):
-            try:
-                self.__stats[stat_names[i]] = reduce(
-                        lambda x, y: x + y, np.array(stat_lists[i])
-                        ) / len(stat_lists[i])
-            except TypeError:
-                self.__stats[stat_names[i]] = float('nan')
+        """Preprocessing of stats queue to reduce variation. Builds a
+           new snapshot, so earlier ones never change. Rows the callback
+           wrote to during the copy, including the one it may still be
+           writing, are left out of it."""
+        stats, generation = {}, self.__samp_count
+        samples = self.__samples.copy()
+        touched = min(self.__samp_count - generation + 1, self.__SAMP_NUM)
+        valid = np.arange(self.__SAMP_NUM) < generation
+        valid[(generation + np.arange(touched)) % self.__SAMP_NUM] = False
+        samples = samples[valid]
+        if not len(samples):
+            for name in self.__STAT_NAMES: stats[name] = float('nan')
+            stats["stus"] = "NONE"
+            self.__stats, self.__stats_gen = stats, generation
+            return
+
+        # Remove outliers of every stat at once, then average the rest
+        keep = np.repeat(self.__not_outlier(samples), self.__STAT_SIZES, axis=1)
+        kept = keep.sum(axis=0)
+        means = np.where(kept > 0,
+                (samples * keep).sum(axis=0) / np.maximum(kept, 1),
+                samples.mean(axis=0)) # All rejected: use every sample
+        means.setflags(write=False)
+        for i, name in enumerate(self.__STAT_NAMES):
+            value = means[self.__STAT_COLS[i]:self.__STAT_COLS[i + 1]]
+            stats[name] = value if len(value) > 1 else value[0]
 
         # Convert heading from radians w/ 0 as East to degrees w/ 0 as North
-        self.__stats["deg"] = ((-self.__stats["deg"] * 180 / math.pi) + 450) % 360
+        stats["deg"] = ((-stats["deg"] * 180 / math.pi) + 450) % 360
 
         # Set flight status
-        self.__set_stus()
+        self.__set_stus(stats)
+        self.__stats, self.__stats_gen = stats, generation
 
-    def __set_stus(self):
+    def __set_stus(self, stats):
         """Determines current mode of flight. Noted in ps_drone
            library that 'HOVERING' should be taken as 'LANDING'"""
         dem_0 = self.__drone.NavData["demo"][0]
@@ -109,49 +166,21 @@ class Navigator:
         elif h_bit and l_bit: stus = "FLYING"
         elif f_bit and l_bit: stus = "LANDED"
         else: stus = "NONE"
-        self.__stats["stus"] = stus
-
-    def __not_outlier(self, points, thresh=3.5):
-        """Identifies outliers and returns list of booleans identifying
-           their locations with 'False' to reject them."""
-        if len(points.shape) == 1:
-            points = points[:, None]
-        median = np.median(points, axis=0)
-        diff = np.sum((points - median)**2, axis=-1)
-        diff = np.sqrt(diff)
-        med_abs_deviation = np.median(diff)
+        stats["stus"] = stus
+
+    def __not_outlier(self, samples, thresh=3.5):
+        """Identifies outliers of every stat in the sample matrix and
+           returns a (samples x stats) matrix of booleans identifying
+           their locations with 'False' to reject them. Vector stats
+           use the distance of the whole vector from their median."""
+        median = np.median(samples, axis=0)
+        diff = np.sqrt(np.add.reduceat(
+                (samples - median)**2, self.__STAT_COLS[:-1], axis=1))
+        med_abs_deviation = np.median(diff, axis=0)
         modified_z_score = 0.6745 * diff / (med_abs_deviation + 1e-10)
 
         return modified_z_score < thresh
 
-    def __get_stats(self):
-        """Get stats list with human-readable sensor data."""
-        stats = {}
-        # Get fresh NavData
-        NDC = self.__drone.NavDataCount
-        while self.__drone.NavDataCount == NDC or not all(
-                package in self.__drone.NavData for package in self.__REQ_PACKS):
-            time.sleep(0.01)
-
-        # Straightforward data
-        stats["acc"] = self.__drone.NavData["raw_measures"][0]
-        stats["gyr"] = self.__drone.NavData["raw_measures"][1]
-        stats["gps"] = self.__drone.NavData["gps"][:-1] # not using altitude value
-        stats["pry"] = self.__drone.NavData["demo"][2] # pitch roll yaw
-        stats["mfu"] = self.__drone.NavData["magneto"][6]
-        stats["vel"] = self.__drone.NavData["demo"][4] # xyz velocity mm/s
-
-        # Convert altitude to meters
-        stats["alt"] = self.__drone.NavData["altitude"][0] / 1000.0
-
-        # Turn magnetometer data into heading (degrees)
-        stats["mag"] = self.__drone.NavData["magneto"][0][:-1] # not using z value
-        for i in range(len(stats["mag"])): stats["mag"][i] -= self.__mag_avg[i]
-        stats["deg"] = -1 * math.atan2(stats["mag"][1], stats["mag"][0])
-
-        # Set new stats
-        return stats
-
     def next_tar_warning(self):
         """Pop the next coordinate from the queue to current target"""
         print waypoints
@@ -163,20 +192,24 @@ class Navigator:
         self.__tar_gps = tar
 
     # Calibration functions
-    def __calc_mag(self):
-        """Rotates the drone to acquire mag data to use in normalization."""
-        mag_x, mag_y = [], []
-        for i in range(self.__mag_acc):
-            NDC = self.__drone.NavDataCount
-            while self.__drone.NavDataCount == NDC: time.sleep(0.01)
-            mag = self.__drone.NavData["magneto"]
-            mag_x.append(mag[0])
-            mag_y.append(mag[1])
-            self.__drone.turnAngle(-(360.0 / self.__mag_acc), 1.0)
-            self.__drone.hover()
-            time.sleep(2)
-        self.__mag_avg[0] = np.mean(np.array(mag_x))
-        self.__mag_avg[1] = np.mean(np.array(mag_y))
+    def __calc_mag(self, speed=0.5, timeout=30.0):
+        """Spins the drone around once at a steady rate, streaming every
+           magnetometer reading into an ellipse fit, and uses its hard
+           and soft iron correction if the fit is good. Returns the
+           compass.CompassCalibration with the fit quality, and whether
+           it is used."""
+        fit = compass.CompassCalibration()
+        self.__mag_fit = fit
+        begin = time.time()
+        self.__drone.turnRight(speed)
+        while fit.turned < self.__MAG_TURN and time.time() - begin < timeout:
+            time.sleep(0.05)
+        self.__drone.hover()
+        self.__mag_fit = None
+        good = (fit.fit() and fit.rms <= self.__MAG_RMS
+                and fit.coverage >= self.__MAG_COVER)
+        if good: self.__mag_cal = (fit.offset, fit.matrix)
+        return fit, good
 
     def calibrate_drone(self, *mag):
         """Basic gyroscope and magnetometer recalibration."""
@@ -188,8 +221,10 @@ class Navigator:
         self.__drone.mtrim()
         time.sleep(5)
         if mag:
-            self.__calc_mag()
-            print self.__mag_avg
+            fit, good = self.__calc_mag()
+            if fit.radius == None: print ">>> Magnetometer calibration failed"
+            else: print ">>> Magnetometer offset {}, rms {:.3f}, coverage {:.2f}: {}".format(
+                    fit.offset, fit.rms, fit.coverage, "used" if good else "rejected")
         self.__drone.land()
 
     # Autonomous flight functions
@@ -198,46 +233,50 @@ class Navigator:
         try: self.__tar_gps = self.waypoints.popleft()
         except IndexError: self.__tar_gps = None
 
-    def __calc_distance(self, start, finish):
-        """Calculate distance to target"""
-        r = 6371e3  # earth's radius in m
-        x, y = start, finish
-
-        # Convert GPS degrees to radians
-        phi1 = math.radians(x[0])
-        phi2 = math.radians(y[0])
-        dphi = math.radians(y[0] - x[0])
-        dlam = math.radians(y[1] - x[1])
-
-        # 'Great circle' distance between two GPS coords
-        a = math.sin(dphi / 2) * math.sin(dphi / 2)
-        a += math.cos(phi1) * math.cos(phi2)
-        a *= (math.sin(dlam / 2) * math.sin(dlam / 2))
-        return 2 * r * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-
-    def __calc_heading(self, start, finish):
-        """Calculate necessary heading for straight flight to target"""
-        x, y = start, finish
-
-        # Initial heading required for 'Great circle' traversal
-        q = math.sin(y[1] - x[1]) * math.cos(y[0])
-        p = math.cos(x[0]) * math.sin(y[0])
-        p -= math.sin(x[0]) * math.cos(y[0]) * math.cos(y[1] - x[1])
-        b = math.atan2(q, p) * 180.0 / math.pi
-        return (b + 360.0) % 360.0
+    def __plane(self):
+        """The navigation plane around home; raises before a GPS fix."""
+        enu = self.__enu
+        if enu == None: raise RuntimeError("No GPS fix yet, Home is not set")
+        return enu
+
+    def __project(self, gps):
+        """Local (east, north) of a waypoint, projected once."""
+        key = (gps[0], gps[1])
+        if key not in self.__projected:
+            self.__projected[key] = self.__plane().to_local(gps[0], gps[1])
+        return self.__projected[key]
+
+    def __calc_leg(self, gps):
+        """Calculate distance, heading and cross-track error from the
+           current position to the target, in the plane around home.
+           A leg starts at the previous target, or where the drone was
+           when it got its first target."""
+        east, north = self.__plane().to_local(gps[0], gps[1])
+        tar_e, tar_n = self.__project(self.__tar_gps)
+        if self.__leg[0] != self.__tar_gps:
+            prev = self.__leg[0]
+            start = self.__project(prev) if prev != None else (east, north)
+            self.__leg = (self.__tar_gps, start)
+        start_e, start_n = self.__leg[1]
+
+        self.__tar_dist = math.hypot(tar_e - east, tar_n - north)
+        self.__tar_angle = math.degrees(math.atan2(tar_e - east, tar_n - north)) % 360.0
+        leg_e, leg_n = tar_e - start_e, tar_n - start_n
+        length = math.hypot(leg_e, leg_n)
+        if length: self.__tar_xtrack = (leg_n * (east - start_e) - leg_e * (north - start_n)) / length
+        else: self.__tar_xtrack = 0.0
 
     def get_move(self):
-        """Perform calculations to get arguments for a drone move"""
-        if self.__tar_gps == None: return ([0.0, 0.0, 0.0, 0.0], -1)
-        self.__set_stats()
+        """Perform calculations to get arguments for a drone move.
+           Without a target or a GPS fix, the move is to stay (-1)."""
+        if self.__tar_gps == None or self.__enu == None: return ([0.0, 0.0, 0.0, 0.0], -1)
+        stats = self.get_state()
+        if not geo.is_fix(*stats["gps"][:2]): return ([0.0, 0.0, 0.0, 0.0], -1)
 
         # Get angle of required turn
-        self.__tar_angle = self.__calc_heading(list(self.__stats["gps"]),
-                self.__tar_gps)
-        self.__tar_dist = self.__calc_distance(list(self.__stats["gps"]),
-                self.__tar_gps)
+        self.__calc_leg(stats["gps"])
         angle_diff = self.__drone.angleDiff(
-                self.__stats["deg"], self.__tar_angle)
+                stats["deg"], self.__tar_angle)
 
         # If drastic turn is needed, only perform that turn
         if   angle_diff >  10.0:
@@ -257,15 +296,13 @@ class Navigator:
     def get_move_no_rot(self):
         """Like get_move(), but no rotation at all; used for single initial
         heading reading"""
-        # If no target, no movement
-        if self.__tar_gps == None: return ([0.0, 0.0, 0.0, 0.0], -1)
-        self.__set_stats()
+        # If no target or no GPS fix, no movement
+        if self.__tar_gps == None or self.__enu == None: return ([0.0, 0.0, 0.0, 0.0], -1)
+        stats = self.get_state()
+        if not geo.is_fix(*stats["gps"][:2]): return ([0.0, 0.0, 0.0, 0.0], -1)
 
         # Calculations for required heading and distance
-        self.__tar_angle = self.__calc_heading(list(self.__stats["gps"]),
-                self.__tar_gps)
-        self.__tar_dist = self.__calc_distance(list(self.__stats["gps"]),
-                self.__tar_gps)
+        self.__calc_leg(stats["gps"])
 
         print self.__tar_angle
         # Begin movement toward target with fractions of full speed
@@ -296,10 +333,66 @@ class Navigator:
         if interrupt: self.__tar_gps = None
         for waypoint in waypoints: self.waypoints.append(waypoint)
 
-    def get_nav(self):
-        self.__set_stats()
+    def get_nav(self, max_age=None, timeout=1.0):
+        """Returns the stats snapshot of the current samples. It is only
+           recomputed when new samples arrived, and must not be modified.
+           With max_age (seconds), first waits for a sample that new, but
+           no longer than timeout (seconds) or until stop(); then the
+           stale snapshot is returned, check its age with get_age()."""
+        if max_age is not None:
+            give_up = time.time() + timeout
+            while (time.time() - self.__samp_time > max_age
+                    and time.time() < give_up and not self.__stopped.is_set()):
+                self.__stopped.wait(self.__SAMP_TIME)
+        if self.__stats_gen != self.__samp_count: self.__set_stats()
         return self.__stats
 
+    def get_age(self):
+        """Seconds since the last sample, infinite before the first."""
+        if not self.__samp_count: return float("inf")
+        return time.time() - self.__samp_time
+
+    def plan_route(self, targets, start=None, time_budget=None):
+        """Orders targets (each [lat, lon]) into a short route from
+           start, by default the current position; see route.optimize.
+           Returns the targets in visiting order. Raises RuntimeError
+           before a GPS fix."""
+        if not targets: return []
+        enu = self.__plane()
+        if start == None: start = self.get_state()["gps"]
+        if not geo.is_fix(start[0], start[1]): start = self.__home
+        tars = np.array(targets, float)
+        east, north = enu.to_local(tars[:, 0], tars[:, 1])
+        order, length = route.optimize(np.column_stack((east, north)),
+                enu.to_local(start[0], start[1]), time_budget)
+        return [targets[i] for i in order]
+
+    def get_leg(self):
+        """Distance (m), heading (degrees) and cross-track error (m)
+           to the current target, as of the last move calculation."""
+        return self.__tar_dist, self.__tar_angle, self.__tar_xtrack
+
+    def load_trees(self, path):
+        """Reads the orchard's trees (CSV or GeoJSON, see trees.load) into
+           a registry in the navigation plane; returns how many. Raises
+           RuntimeError before a GPS fix."""
+        self.trees = trees.load(path, self.__plane())
+        return len(self.trees)
+
+    def get_tree(self):
+        """(id, distance) of the tree nearest the current position, None
+           without a tree registry or a GPS fix."""
+        if self.trees == None: return None
+        gps = self.get_state()["gps"]
+        if not geo.is_fix(gps[0], gps[1]): return None
+        return self.trees.nearest(gps[0], gps[1])
+
+    def get_state(self):
+        """Current position ("gps"), heading ("deg"), altitude and
+           velocity of the state estimator; the averaged stats of
+           get_nav() until it has a GPS fix."""
+        return self.__estimator.state() or self.get_nav()
+
     def set_target(self, new_target):
         """If the drone is already moving toward a target,
            move current target to waypoint queue and move
@@ -309,80 +402,28 @@ class Navigator:
         if old_target != None:
             self.mod_waypoints([old_target])
 
-    def __traverse_box(self, vrt_diff, g_range, is_ew, is_ltr, temp_waypoints,
-            temp_lat, rec_vrts_3, rec_vrts_1, rec_vrts_2, temp_lon):
-        if is_ew:
-            vert_1, vert_2, vert_3 = rec_vrts_1[0], rec_vrts_2[0], rec_vrts_3[0]
-        else:
-            vert_1, vert_2, vert_3 = rec_vrts_1[1], rec_vrts_2[1], rec_vrts_3[1]
-
-        for vrtx in range(g_range):
-            vrtx_even = ((vrtx % 2) == 0)
-            if is_ltr:
-                if is_ew: temp_lon += vrt_diff
-                else: temp_lat += vrt_diff
-            else:
-                if is_ew: temp_lon -= vrt_diff
-                else: temp_lat -= vrt_diff
-            if vrtx_even and (vrtx < g_range - 1):
-                temp_waypoints.append([temp_lat, temp_lon])
-                if is_ew: temp_lat = vert_3
-                else: temp_lon = vert_3
-                temp_waypoints.append([temp_lat, temp_lon])
-            elif not vrtx_even and (vrtx < g_range - 1):
-                temp_waypoints.append([temp_lat, temp_lon])
-                if is_ew: temp_lat = vert_1
-                else: temp_lon = vert_1
-                temp_waypoints.append([temp_lat, temp_lon])
-            elif not vrtx_even and (vrtx == g_range - 1):
-                temp_waypoints.append([temp_lat, temp_lon])
-                if is_ew: temp_lat = vert_3
-                else: temp_lon = vert_3
-                temp_waypoints.append([temp_lat, temp_lon])
-                break
-            elif vrtx_even and (vrtx == g_range - 1):
-                temp_waypoints.append([temp_lat, temp_lon])
-                if is_ew: temp_lat = vert_2
-                else: temp_lon = vert_2
-                temp_waypoints.append([temp_lat, temp_lon])
-                break
-
-    def gen_waypnts(self, gps_coors):
-        """Using list of GPS coordinates indicating a rectangle,
-           calculates a route within the rectangle and populates
-           waypoint list with results."""
+    def gen_waypnts(self, gps_coors, alt=None, overlap=None):
+        """Using list of GPS coordinates outlining a field (any polygon,
+           vertices in order), calculates a back and forth route covering
+           it and populates waypoint list with results. Passes are spaced
+           for the camera footprint at alt (default: current altitude)
+           with the given overlap, along the direction with fewest turns.
+           Raises RuntimeError before a GPS fix."""
         if not gps_coors: return True
-        g_range = 6
-
-        # GPS path coordinates
-        temp_waypoints = deque()
-
-        rec_vrts_1 = gps_coors[0]
-        rec_vrts_2 = gps_coors[1]
-        rec_vrts_3 = gps_coors[2]
-
-        # E-W/W-E: rect height < rect width; N-S/S-N: rect width < rect height
-        lat_diff = abs(rec_vrts_1[0] - rec_vrts_3[0])
-        lon_diff = abs(rec_vrts_1[1] - rec_vrts_3[1])
-        is_eastwest = lon_diff > lat_diff
-
-        # Did user make left-to-right selection?
-        ltr_lon = rec_vrts_1[1] < rec_vrts_3[1]
-        ltr_lat = rec_vrts_1[0] < rec_vrts_3[0]
-
-        if is_eastwest: # East-to-West or West-to-East
-            is_ltr = ltr_lon
-            vrt_diff = lon_diff / g_range
-        else: # North-to-South or South-to-North
-            is_ltr = ltr_lat
-            vrt_diff = lat_diff / g_range
-        temp_lon = rec_vrts_1[1]
-        temp_lat = rec_vrts_1[0]
-        temp_waypoints.append([temp_lat, temp_lon])
-
-        # Generate waypoints using derived vertices
-        self.__traverse_box(vrt_diff, g_range, is_eastwest, is_ltr, temp_waypoints,
-                temp_lat, rec_vrts_3, rec_vrts_1, rec_vrts_2, temp_lon)
+        enu = self.__plane()
+        if alt == None: alt = self.get_state()["alt"]
+        if not alt >= self.__MIN_ALT: alt = self.__MIN_ALT # Also before a fix (NaN)
+        if overlap == None: overlap = self.__OVERLAP
+        spacing = coverage.pass_spacing(self.__CAM_FOV, alt, overlap)
+
+        # Plan in local meters, starting at the corner nearest the drone
+        vrts = np.array(gps_coors, float)
+        poly = np.column_stack(enu.to_local(vrts[:, 0], vrts[:, 1]))
+        gps = self.get_state()["gps"]
+        here = enu.to_local(gps[0], gps[1]) if geo.is_fix(gps[0], gps[1]) else None
+        path = coverage.boustrophedon(poly, spacing, start=here)
+        lat, lon = enu.to_gps(path[:, 0], path[:, 1])
+        temp_waypoints = np.column_stack((lat, lon)).tolist()
 
         # Clear current waypoints and use new ones
         self.waypoints.clear()
@@ -2,7 +2,7 @@
 # ps_drone.py
 # (w)+(c) J. Philipp de Graaff, www.playsheep.de, drone@playsheep.de, 2012-2015
 # Project homepage: www.playsheep.de/drone and https://sourceforge.net/projects/ps-drone/
-# Dependencies: a POSIX OS, openCV2 for video-support.
+# Dependencies: a POSIX OS, PyAV (libav) for video-decoding, openCV2 for video-display.
 # Base-program of the PS-Drone API: "An open and enhanced API for universal control of the Parrot AR.Drone 2.0 quadcopter."
 ##########
 # Modified and advanced version, based on a part of the master of computer science degree dissertation "Universelle
@@ -20,8 +20,9 @@
 # Dedicated to my beloved wife.
 ###########
 
-import threading, select, socket, time, tempfile, multiprocessing, struct, os, sys
-import thread, signal, subprocess
+import threading, select, socket, time, multiprocessing, struct, os, sys, collections, mmap
+import thread, signal, subprocess, Queue
+import numpy
 
 if os.name == 'posix': import termios, fcntl # for getKey(), ToDo: Reprogram for Windows
  
@@ -64,9 +65,16 @@ class Drone(object):
                 self.__NavDataTimeStamp = 0.0
                 self.__NavDataDecodingTime = 0.0
                 self.__NoNavData = False
+                self.__NavDataCallbacks = []                            # Called with each new NavData-package, see addNavDataCallback()
 
          # Video variables
-                self.__VideoImage = None
+                self.__VideoRing = None
+                self.__VideoSlot = -1
+                self.__PreviewRing = None
+                self.__PreviewSlot = -1
+                self.__PoseHistory = PoseHistory()
+                self.__GeoFrame = (-1, 0, None)                          # Slot and seq of the latest image, and the pose it was taken at
+                self.__VideoMetrics = VideoMetrics()                    # Shared with the video-processes
                 self.__VideoImageCount = 0
                 self.__VideoDecodeTimeStamp = 0
                 self.__VideoDecodeTime = 0
@@ -126,17 +134,19 @@ class Drone(object):
 
          ##### Initialising timed thread(s) for drone communication
          # Opening NavData- and Video- Processes
-                self.__VidPipePath = tempfile.gettempdir()+"/dronevid-"+str(threading.enumerate()[0])[-12:-2]+"-"+str(time.time())[-7:].replace(".","")+".h264"
                 self.__net_pipes = []
+                self.__frame_pipe, frameChild_pipe = multiprocessing.Pipe(False)       # One-way: Video-process -> videodecode-process
+                self.__VideoRing = FrameRing()                                                                  # Shared with the videodecode-process, so it has to exist before forking
+                self.__PreviewRing = FrameRing(4, PREVIEW_HEIGHT, PREVIEW_WIDTH)               # Downscaled copies for displays
                 self.__NavData_pipe, navdataChild_pipe            = multiprocessing.Pipe()
                 self.__Video_pipe,   videoChild_pipe          = multiprocessing.Pipe()
                 self.__vdecode_pipe, self.__vdecodeChild_pipe = multiprocessing.Pipe()
 
                 self.__NavDataProcess = multiprocessing.Process( target=mainloopND, args=(self.DroneIP,self.NavDataPort,navdataChild_pipe,os.getpid()))
                 self.__NavDataProcess.start()
-                self.__VideoProcess =   multiprocessing.Process( target=mainloopV, args=(self.DroneIP,self.VideoPort,self.__VidPipePath,videoChild_pipe,os.getpid()))
+                self.__VideoProcess =   multiprocessing.Process( target=mainloopV, args=(self.DroneIP,self.VideoPort,frameChild_pipe,videoChild_pipe,self.__VideoMetrics,os.getpid()))
                 self.__VideoProcess.start()
-                self.__vDecodeProcess = multiprocessing.Process( target=vDecode, args=(self.__VidPipePath,self.__vdecodeChild_pipe,os.getpid()))
+                self.__vDecodeProcess = multiprocessing.Process( target=vDecode, args=(self.__frame_pipe,self.__VideoRing,self.__PreviewRing,self.__vdecodeChild_pipe,self.__VideoMetrics,os.getpid()))
          # There is a third process called "self.__vDecodeProcess" for decoding video, initiated and started around line 880
 
          # Final settings
@@ -210,7 +220,28 @@ class Drone(object):
         @property
         def NoNavData(self): return self.__NoNavData
         @property
-        def VideoImage(self): return self.__VideoImage
+        def VideoImage(self):
+                """A copy of the latest complete image in VideoRing, not a view of the shared memory: a view could change or
+                   tear while being used, as the decoder overwrites ring slots. Modifying it does not affect the ring."""
+                if self.__VideoSlot < 0: return None
+                frame = self.__VideoRing.read()
+                if frame: return frame[0]
+        @property
+        def VideoPreview(self):  # Like VideoImage, but at most PREVIEW_WIDTH x PREVIEW_HEIGHT; cheap to display
+                if self.__PreviewSlot < 0: return None
+                frame = self.__PreviewRing.read()
+                if frame: return frame[0]
+        @property
+        def VideoPose(self): return self.__GeoFrame[2]  # Interpolated NavData at the moment the latest image was taken (see PoseHistory)
+        @property
+        def GeoImage(self):  # (image, pose) of the latest image, a copy; None if the image was overwritten before it was read
+                slot, seq, pose = self.__GeoFrame
+                if slot < 0: return None
+                frame = self.__VideoRing.read(slot, seq)
+                if frame: return (frame[0], pose)
+        @property
+        def VideoMetrics(self): return self.__VideoMetrics  # To record further stages (analysis, display) or draw an overlay
+        def video_metrics(self): return self.__VideoMetrics.report()
         @property
         def VideoImageCount(self): return self.__VideoImageCount
         @property
@@ -484,6 +515,14 @@ class Drone(object):
         def reconnectNavData(self):
                 self.__NavData_pipe.send("reconnect")
 
+ # Calls function(NavData, NavDataCount, timeStamp) in the receiving thread for every new NavData-package, instead of polling NavDataCount.
+ # timeStamp is the local time the package was decoded. Keep it short, the next package waits for it.
+        def addNavDataCallback(self,function):
+                with self.__lock: self.__NavDataCallbacks = self.__NavDataCallbacks + [function]    # Replaced, never changed, so the receiver can iterate it unlocked
+
+        def removeNavDataCallback(self,function):
+                with self.__lock: self.__NavDataCallbacks = [f for f in self.__NavDataCallbacks if f != function]
+
  ###### Video & Marker commands
  # This makes the drone fly around and follow 2D tags which the camera is able to detect.
         def aflight(self, flag):
@@ -513,6 +552,26 @@ class Drone(object):
                 if do: self.__Video_pipe.send("saveVideo")
                 else: self.__Video_pipe.send("unsaveVideo")
 
+        def recordVideo(self, *args):  # recordVideo(directory, seconds per segment); recordVideo(False) stops recording
+                try: do = args[0]
+                except: do = True
+                if do:
+                        if do == True: do = "."
+                        try: segmentTime = args[1]
+                        except: segmentTime = 60
+                        self.__Video_pipe.send(("record", do, segmentTime))
+                else: self.__Video_pipe.send("unrecord")
+
+        def geoImages(self, timeout=1.0):  # Yields (image, pose) for every new image, ends when there was none for "timeout" seconds
+                count, last = self.__VideoImageCount, time.time()
+                while time.time()-last < timeout:
+                        if self.__VideoImageCount == count:
+                                time.sleep(0.005)
+                                continue
+                        count, last = self.__VideoImageCount, time.time()
+                        geoImage = self.GeoImage
+                        if geoImage: yield geoImage
+
         def startVideo(self, *args):
                 try: do = args[0]
                 except: do = True
@@ -915,17 +974,27 @@ class Drone(object):
                         for ip in in_pipe:  # ...go and get it
                                 if ip == self.__NavData_pipe:  ### Receiving sensor-values from NavData-process
                                         self.__NavData, self.__State, self.__NavDataCount, self.__NavDataTimeStamp, self.__NavDataDecodingTime, self.__NoNavData = self.__NavData_pipe.recv()
+                                        stamp = time.time()-self.__NavDataDecodingTime
+                                        self.__PoseHistory.add(stamp, self.__NavData)
+                                        for callback in self.__NavDataCallbacks:
+                                                try: callback(self.__NavData, self.__NavDataCount, stamp)
+                                                except Exception as e: print "NavData-callback failed: "+str(e)
                                 if ip == self.__vdecode_pipe:  ### Receiving imagedata and feedback from videodecode-process
                                         cmd, VideoImageCount, VideoImage, VideoDecodeTime = self.__vdecode_pipe.recv() # Imagedata
                                         if self.showCommands and cmd!="Image" : print "** vDec -> Com :",cmd    
                                         if cmd == "suicided": self.__Video_pipe.send("vd died")  # videodecode-process died
-                                        if cmd == "foundCodec": self.__Video_pipe.send("foundCodec") # the codec of the videostream has been found, do not flood anymore
                                         if cmd == "VideoUp": self.__VideoReady = True                    # Imagedata is available
                                         if cmd == "keypressed": self.__vKey = VideoImage                         # Pressed key on window
                                         if cmd == "reset": self.__Video_pipe.send(cmd)                   # proxy to videodecode-process
-                                        if cmd == "Image":  # Imagedata !
+                                        if cmd == "Image":  # Imagedata ! The images are in VideoRing and PreviewRing, VideoImage holds their slots
                                                 self.__VideoImageCount =        VideoImageCount
-                                                self.__VideoImage =                     VideoImage
+                                                self.__VideoSlot, self.__PreviewSlot = VideoImage
+                                                slot = self.__VideoRing.latest()        # The message's slot may be stale already, the ring's header is not
+                                                seq = self.__VideoRing.seq(slot)
+                                                info = self.__VideoRing.info(slot).copy()
+                                                if not seq % 2 and self.__VideoRing.seq(slot) == seq:
+                                                        frameTime = self.__PoseHistory.frameTime(info["timestamp"], info["received"])
+                                                        self.__GeoFrame = (slot, seq, self.__PoseHistory.pose(frameTime))
                                                 self.__VideoDecodeTime =        VideoDecodeTime
                                                 self.__VideoDecodeTimeStamp = time.time()-self.__startTime
                                 if ip == self.__Video_pipe:  ### Receiving feedback from videostream-process
@@ -933,9 +1002,9 @@ class Drone(object):
                                         if self.showCommands and cmd != "": print "** Vid -> Com : ",cmd
                                         if cmd == "vDecProc":  # videodecode-process should start
                                                 if not self.__vDecodeRunning:
-                                                        self.__vDecodeProcess = multiprocessing.Process( target=vDecode, args=(self.__VidPipePath,self.__vdecodeChild_pipe,os.getpid()))
+                                                        self.__vDecodeProcess = multiprocessing.Process( target=vDecode, args=(self.__frame_pipe,self.__VideoRing,self.__PreviewRing,self.__vdecodeChild_pipe,self.__VideoMetrics,os.getpid()))
                                                         self.__vDecodeProcess.start()
-                                                        self.__net_pipes.append(self.__vdecode_pipe)
+                                                        if not self.__net_pipes.count(self.__vdecode_pipe): self.__net_pipes.append(self.__vdecode_pipe)
                                                         self.__vDecodeRunning = True
 
                                                 self.__Video_pipe.send("vDecProcON")
@@ -950,7 +1019,7 @@ class Drone(object):
                                         if cmd == "hide": self.__vdecode_pipe.send(cmd)  # proxy to videodecode-process
                                         if cmd == "vDecProcKill":
                                                 self.__vdecode_pipe.send("die!") # videodecode-process should switch off
-                                                vDecodeRunning = False
+                                                self.__vDecodeRunning = False
                                 if ip==self.__Config_pipe and not self.__networksuicide: ### Receiving drone-configuration
                                         try:
                                                 if self.__networksuicide:   break                                                        # Does not stop sometimes, so the loop will be forced to stop
@@ -1013,6 +1082,437 @@ def normalLen8(value):
 ##################################################################################################
 ###### Receive and Decode Video                                                                                                                  ######
 ##################################################################################################
+##### PaVE ####################################################################
+# Every frame on the video-port is wrapped into a PaVE-header ("Parrot Video Encapsulation", see video_encapsulation.h
+#   of the official SDK). The header contains its own size and the size of the following H.264-payload, so frames can be
+#   cut out of the TCP-stream exactly, wherever the network has split it.
+PaVE_SIGNATURE =        "PaVE"
+PaVE_HEADER =           struct.Struct("<4sBBHIHHHHIIBBBB")      # Fixed part of the header, up to frame_type and control
+PaVE_FRAME_IDR, PaVE_FRAME_I, PaVE_FRAME_P, PaVE_FRAME_HEADERS = 1, 2, 3, 4
+PaVE_KEYFRAMES =        (PaVE_FRAME_IDR, PaVE_FRAME_I)
+PaVE_MAXPAYLOAD =       4194304                                                 # Anything bigger is a corrupted header
+PaVE_MINFREE =          65536                                                   # Free space required in front of a recv
+
+PaVEHeader = collections.namedtuple("PaVEHeader", "signature version codec headerSize payloadSize encodedWidth encodedHeight "
+                                                                                        "displayWidth displayHeight frameNumber timestamp totalChunks chunkIndex frameType control")
+
+class PaVEAssembler(object):
+ # Receives the video-stream directly into a preallocated buffer and cuts complete frames out of it.
+ # Frames are handed out as memoryviews of that buffer, so they are only valid until the next call of recvFrom().
+        def __init__(self, size=1048576):
+                self.buffer =   bytearray(size)
+                self.__view =   memoryview(self.buffer)
+                self.__start =  0                                                       # First byte not yet handed out as (part of) a frame
+                self.__end =    0                                                       # First free byte
+                self.skipped =  0                                                       # Bytes thrown away while searching for a signature
+
+        def reset(self):
+                self.__start, self.__end = 0, 0
+
+        def pending(self): return self.__end-self.__start   # Received bytes not handed out yet
+
+        def recvFrom(self, sock):  # Returns the number of received bytes, 0 means the connection is closed
+                if len(self.buffer)-self.__end < PaVE_MINFREE: self.__makeRoom(self.__end-self.__start+PaVE_MINFREE)
+                received = sock.recv_into(self.__view[self.__end:])
+                self.__end += received
+                return received
+
+        def frames(self):  # Yields (header, payload) for every complete frame in the buffer
+                while self.__end-self.__start >= PaVE_HEADER.size:
+                        pos = self.__start
+                        header = PaVEHeader._make(PaVE_HEADER.unpack_from(self.buffer, pos))
+                        if header.signature != PaVE_SIGNATURE or header.headerSize < PaVE_HEADER.size or header.payloadSize > PaVE_MAXPAYLOAD:
+                                self.__resync(pos+1)
+                                continue
+                        frameEnd = pos+header.headerSize+header.payloadSize
+                        if frameEnd > self.__end:  # Frame is not complete yet, make sure it will fit
+                                if frameEnd > len(self.buffer): self.__makeRoom(frameEnd-pos+PaVE_MINFREE)
+                                break
+                        self.__start = frameEnd
+                        yield header, self.__view[pos+header.headerSize:frameEnd]
+                if self.__start == self.__end: self.__start, self.__end = 0, 0   # Nothing left, next recv starts at the front
+
+        def __resync(self, pos):  # Skips to the next signature, keeps a possibly split signature at the end
+                found = self.buffer.find(PaVE_SIGNATURE, pos, self.__end)
+                if found < 0: found = max(pos, self.__end-len(PaVE_SIGNATURE)+1)
+                self.skipped += found-self.__start
+                self.__start = found
+
+        def __makeRoom(self, needed):  # Moves the unfinished frame to the front, grows the buffer just if a frame is that big
+                left = self.__end-self.__start
+                if needed > len(self.buffer):
+                        buf = bytearray(needed)
+                        buf[0:left] = self.__view[self.__start:self.__end]
+                        self.buffer, self.__view = buf, memoryview(buf)
+                elif self.__start:
+                        self.buffer[0:left] = self.buffer[self.__start:self.__end]
+                self.__start, self.__end = 0, left
+
+##### Frame-ring ##############################################################
+# Decoded images are not pickled through a pipe, but written into preallocated slots of anonymous shared memory,
+#   which is inherited by the videodecode-process. The main-process just gets the number of the slot.
+# Each slot has a sequence-number that is odd while the slot is written. The writer never touches the latest slot,
+#   so a view of it stays valid until the writer has gone round the ring.
+FRAMERING_SLOT = numpy.dtype([("seq",numpy.int64), ("count",numpy.int64), ("height",numpy.int32), ("width",numpy.int32),
+                                                          ("timestamp",numpy.float64), ("decTime",numpy.float64), ("received",numpy.float64)])
+
+PREVIEW_WIDTH, PREVIEW_HEIGHT = 640, 360
+
+class FrameRing(object):
+        def __init__(self, slots=4, height=720, width=1280):
+                self.slots =            slots
+                self.slotSize =         height*width*3
+                self.__info =           numpy.frombuffer(mmap.mmap(-1, FRAMERING_SLOT.itemsize*slots), FRAMERING_SLOT)
+                self.__latest =         numpy.frombuffer(mmap.mmap(-1, 8), numpy.int64)
+                self.__data =           numpy.frombuffer(mmap.mmap(-1, self.slotSize*slots), numpy.uint8).reshape(slots, self.slotSize)
+                self.__latest[0] =      -1
+
+        def write(self, image, count, timestamp, decTime, received=0.0):  # received: local time the frame came off the network. Returns the slot of the image, -1 if it is too big
+                height, width = image.shape[:2]
+                size = height*width*3
+                if size > self.slotSize: return -1
+                slot = (self.__latest[0]+1)%self.slots
+                info = self.__info[slot:slot+1]
+                info["seq"] += 1                                                                                # Odd: writing
+                self.__data[slot,:size].reshape(height, width, 3)[:] = image
+                info["count"], info["height"], info["width"] = count, height, width
+                info["timestamp"], info["decTime"], info["received"] = timestamp, decTime, received
+                info["seq"] += 1                                                                                # Even: complete
+                self.__latest[0] = slot
+                return slot
+
+        def image(self, slot):
+                info = self.__info[slot]
+                return self.__data[slot,:info["height"]*info["width"]*3].reshape(info["height"], info["width"], 3)
+
+        def seq(self, slot): return self.__info["seq"][slot]  # Compare it before and after using an image to be sure it was not overwritten
+        def read(self, slot=None, seq=None, tries=3):  # (image, info) copied out of slot (default: the latest); with seq, only that version of it. None if there is none or the writer keeps overwriting it
+                for attempt in range(tries):
+                        s = self.__latest[0] if slot is None else slot
+                        if s < 0: return None
+                        before = self.__info["seq"][s]
+                        if seq is not None and before != seq: return None  # Already overwritten
+                        if before % 2: continue                                                 # Being written right now
+                        info = self.__info[s].copy()
+                        image = self.__data[s,:info["height"]*info["width"]*3].reshape(info["height"], info["width"], 3).copy()
+                        if self.__info["seq"][s] == before: return (image, info)
+                return None
+        def info(self, slot): return self.__info[slot]
+        def latest(self): return self.__latest[0]
+
+##### Pose-history ############################################################
+# NavData-values that tell where the drone was, kept in the main-process with the local time they were received at.
+# An image is joined to them by time: its PaVE-timestamp (drone-clock, ms) is mapped onto the local clock by the
+#   smallest delay seen so far between it and the moment the frame came off the network (not when it was decoded, as
+#   that would make every pose late by the decoding-time), which relaxes by 1ms per second to follow clock-drift.
+#   The pose is then interpolated between the two NavData-packages around that moment (angles along the shorter way).
+POSEHISTORY_ROWS = ("time","lat","lon","gpsAlt","alt","pitch","roll","yaw","heading")
+
+class PoseHistory(object):
+        def __init__(self, size=512):
+                self.size =                     size
+                self.__data =           numpy.zeros((len(POSEHISTORY_ROWS), size))
+                self.__count =          0
+                self.__offset =         None                                            # Local time minus PaVE-time of the fastest image
+                self.__lastPaVE, self.__lastNow = 0, 0.0
+                self.__lock =           threading.Lock()
+
+        def add(self, stamp, navdata):  # stamp: local time.time() the NavData was received at
+                if type(navdata) != dict or not "demo" in navdata: return False
+                pitch, roll, yaw =      navdata["demo"][2]
+                alt =                           navdata["demo"][3]/100.0                # cm -> m
+                if "altitude" in navdata:       alt = navdata["altitude"][0]/1000.0     # vision altitude in mm, more precise
+                heading =                       yaw
+                if "magneto" in navdata:        heading = navdata["magneto"][6]         # heading_fusion_unwrapped
+                lat, lon, gpsAlt =      numpy.nan, numpy.nan, numpy.nan
+                if "gps" in navdata:            lat, lon, gpsAlt = navdata["gps"][:3]
+                with self.__lock:
+                        if self.__count and stamp <= self.__data[0,(self.__count-1)%self.size]: return False  # Keep it sorted
+                        self.__data[:,self.__count%self.size] = (stamp, lat, lon, gpsAlt, alt, pitch, roll, yaw, heading)
+                        self.__count += 1
+                return True
+
+        def frameTime(self, paveTime, received=None):  # Local time an image with this PaVE-timestamp was taken at
+                now = time.time()                                                               # received: local time the frame came off the network (default: now). Anchoring to it
+                if received: now = received                                             #   keeps decoding- and transport-latency out of the offset
+                delay = now-paveTime/1000.0
+                if self.__offset is None or paveTime < self.__lastPaVE:       self.__offset = delay   # First image or drone rebooted/wrapped
+                else:   self.__offset = min(delay, self.__offset+(now-self.__lastNow)*0.001)
+                self.__lastPaVE, self.__lastNow = paveTime, now
+                return paveTime/1000.0+self.__offset
+
+        def pose(self, stamp):  # Interpolated pose at local time stamp, None if there is no NavData yet
+                with self.__lock:
+                        n = min(self.__count, self.size)
+                        if not n: return None
+                        order = numpy.arange(self.__count-n, self.__count)%self.size
+                        times = self.__data[0,order]
+                        i = numpy.searchsorted(times, stamp)
+                        a, b = self.__data[:,order[max(i-1,0)]], self.__data[:,order[min(i,n-1)]]
+                if b[0] > a[0]:         f = min(max((stamp-a[0])/(b[0]-a[0]), 0.0), 1.0)
+                else:                           f = 0.0
+                v = a+(b-a)*f
+                for row in (5,6,7,8):                                                           # Angles: the shorter way round
+                        v[row] = a[row]+((b[row]-a[row]+180.0)%360.0-180.0)*f
+                        v[row] = (v[row]+180.0)%360.0-180.0
+                pose = {}
+                pose["time"] =          stamp
+                pose["lag"] =           stamp-times[-1]                                 # > 0: image is newer than the latest NavData, values are held
+                pose["gps"] =           [v[1], v[2], v[3]]
+                pose["alt"] =           v[4]
+                pose["pry"] =           [v[5], v[6], v[7]]
+                pose["heading"] =       v[8]%360.0
+                return pose
+
+##### Progress-watchdog #######################################################
+# One supervising thread per process instead of a new threading.Timer around every read or recv.
+# The hot path just stamps its progress; if it is armed and there was no progress for "timeout" seconds, "action" is
+#   called (and again after every further timeout). Stalls are counted and timed.
+class ProgressWatchdog(object):
+        def __init__(self, timeout, action, args=[], armed=True):
+                self.timeout =          timeout
+                self.stalls =           0                                                       # Number of times the action was fired
+                self.stallTime =        0.0                                                     # Sum of the durations of all finished stalls
+                self.longestStall =     0.0
+                self.__action, self.__args = action, args
+                self.__last, self.__fired, self.__armed = time.time(), False, armed
+                self.__stop =           threading.Event()
+                self.__thread =         threading.Thread(target=self.__watch)
+                self.__thread.daemon = True
+                self.__thread.start()
+
+        def progress(self):
+                now = time.time()
+                if self.__fired:
+                        stall = now-self.__stalledSince
+                        self.stallTime += stall
+                        self.longestStall = max(self.longestStall, stall)
+                        self.__fired = False
+                self.__last = now
+
+        def arm(self):
+                self.__last, self.__fired, self.__armed = time.time(), False, True
+
+        def disarm(self): self.__armed = False
+        def stop(self):
+                self.__stop.set()
+                self.__thread.join()
+
+        def __watch(self):
+                while not self.__stop.wait(self.timeout/10.0):
+                        now = time.time()
+                        if self.__armed and now-self.__last > self.timeout:
+                                if not self.__fired: self.__stalledSince = self.__last
+                                self.__fired, self.__last = True, now
+                                self.stalls += 1
+                                self.__action(*self.__args)
+
+##### Video-metrics ###########################################################
+# Counters of every video-stage in anonymous shared memory, so the video-processes and the main-process write into
+#   the same table. Each stage is written by one process only, so there is no locking.
+# Latencies go into logarithmic histograms (bin i counts latencies up to METRICS_EDGES[i], the last bin all above),
+#   the frame-rate is an exponential average of the intervals between frames.
+METRICS_STAGES = ("receive", "assemble", "ipc", "decode", "analysis", "display")
+METRICS_EDGES =  0.0001*2**numpy.arange(16)                            # 0.1ms ... 3.3s
+METRICS_STAGE =  numpy.dtype([("count",numpy.int64), ("dropped",numpy.int64), ("depth",numpy.int64), ("maxDepth",numpy.int64),
+                                                          ("latSum",numpy.float64), ("latMax",numpy.float64), ("interval",numpy.float64), ("last",numpy.float64),
+                                                          ("hist",numpy.int64,(len(METRICS_EDGES)+1,))])
+
+class VideoMetrics(object):
+        def __init__(self):
+                self.__stages = numpy.frombuffer(mmap.mmap(-1, METRICS_STAGE.itemsize*len(METRICS_STAGES)), METRICS_STAGE)
+
+        def record(self, stage, latency=None, depth=None):  # One frame passed stage, latency in seconds, depth of its queue
+                row = self.__stages[METRICS_STAGES.index(stage)]
+                now = time.time()
+                if row["last"]: row["interval"] = row["interval"]*0.9+(now-row["last"])*0.1 if row["interval"] else now-row["last"]
+                row["last"] = now
+                row["count"] += 1
+                if latency is not None:
+                        row["latSum"] += latency
+                        row["latMax"] = max(row["latMax"], latency)
+                        row["hist"][numpy.searchsorted(METRICS_EDGES, latency)] += 1
+                if depth is not None:
+                        row["depth"] = depth
+                        row["maxDepth"] = max(row["maxDepth"], depth)
+
+        def drop(self, stage, count=1):  # Frames lost or left out in stage
+                self.__stages[METRICS_STAGES.index(stage)]["dropped"] += count
+
+        def count(self, stage): return self.__stages[METRICS_STAGES.index(stage)]["count"]
+
+        def reset(self): self.__stages[:] = numpy.zeros(1, METRICS_STAGE)
+
+        def report(self):  # {stage: {fps, count, dropped, depth, maxDepth, latAvg, latMax, latP50, latP95, hist}}
+                report = {}
+                now = time.time()
+                for i, stage in enumerate(METRICS_STAGES):
+                        row = self.__stages[i].copy()
+                        hist = row["hist"]
+                        timed = hist.sum()
+                        fps = 0.0
+                        if row["interval"] and now-row["last"] < 2.0: fps = 1.0/row["interval"]    # Stalled stages have no rate
+                        report[stage] = {"fps":fps, "count":int(row["count"]), "dropped":int(row["dropped"]),
+                                                         "depth":int(row["depth"]), "maxDepth":int(row["maxDepth"]),
+                                                         "latAvg":row["latSum"]/timed if timed else 0.0, "latMax":float(row["latMax"]),
+                                                         "latP50":self.__percentile(hist, 0.5), "latP95":self.__percentile(hist, 0.95),
+                                                         "hist":hist.tolist()}
+                return report
+
+        def overlay(self, image, origin=(8,16)):  # Draws one line per stage onto image (BGR or RGB)
+                import cv2
+                x, y = origin
+                report = self.report()
+                for stage in METRICS_STAGES:
+                        r = report[stage]
+                        if not r["count"] and not r["dropped"]: continue
+                        text = "%-8s %5.1ffps %6.1fms p95 %6.1fms q%-3d drop %d" % (stage, r["fps"], r["latAvg"]*1000, r["latP95"]*1000, r["depth"], r["dropped"])
+                        cv2.putText(image, text, (x,y), cv2.FONT_HERSHEY_PLAIN, 0.9, (0,0,0), 3)
+                        cv2.putText(image, text, (x,y), cv2.FONT_HERSHEY_PLAIN, 0.9, (255,255,255), 1)
+                        y += 14
+                return image
+
+        def __percentile(self, hist, fraction):  # Upper edge of the bin that holds the fraction, inf for the overflow-bin
+                total = hist.sum()
+                if not total: return 0.0
+                i = numpy.searchsorted(numpy.cumsum(hist), fraction*total)
+                if i >= len(METRICS_EDGES): return float("inf")
+                return float(METRICS_EDGES[i])
+
+##### Recorder ################################################################
+# Writes the raw H.264-payload of the live-stream into time-segmented .h264-files, without decoding or re-encoding.
+# Every segment starts with an I-frame, so it can be played on its own. A sidecar .idx-file lists byte-offset, PaVE-
+#   timestamp (ms) and frame-number of every I-frame, so recorded flights can be seeked and sliced without parsing.
+# Writing is done by a background thread; if it can not keep up, frames are dropped up to the next I-frame.
+# If a segment can not be opened or written, the error is kept in failed and the rest of the stream is dropped.
+class VideoRecorder(object):
+        def __init__(self, directory, segmentTime=60, queueSize=256):
+                self.directory, self.segmentTime = directory, segmentTime
+                self.frames, self.dropped, self.segments = 0, 0, []
+                self.failed =           None                                                    # IOError/OSError that ended the recording
+                self.__queue =          Queue.Queue(queueSize)
+                self.__waitKey =        True                                                    # Skip frames till the next I-frame
+                self.__thread =         threading.Thread(target=self.__writer)
+                self.__thread.daemon = True
+                self.__thread.start()
+
+        def write(self, header, payload):  # payload has to be a copy, it is written later
+                iFrame = header.frameType in PaVE_KEYFRAMES
+                if self.failed:
+                        self.dropped += 1
+                        return
+                if self.__waitKey and not iFrame: return
+                try:
+                        self.__queue.put_nowait((header.timestamp, header.frameNumber, iFrame, payload))
+                        self.__waitKey = False
+                except Queue.Full:
+                        self.dropped += 1
+                        self.__waitKey = True
+
+        def stop(self, timeout=2.0):  # Never blocks longer than about twice timeout, even if the writer hangs
+                try: self.__queue.put((0, 0, True, None), True, timeout)
+                except Queue.Full: pass
+                self.__thread.join(timeout)
+
+        def __writer(self):
+                video, index, started = None, None, 0
+                while True:
+                        timestamp, frameNumber, iFrame, payload = self.__queue.get()
+                        if self.failed and payload is not None: continue                   # Keep draining, so write() and stop() never wait
+                        try:
+                                if iFrame and (payload is None or time.time()-started >= self.segmentTime):
+                                        if video:
+                                                video.close()
+                                                index.close()
+                                                video, index = None, None
+                                        if payload is None: break
+                                        started = time.time()
+                                        name = os.path.join(self.directory, "drone-"+time.strftime("%Y%m%d-%H%M%S")+"-"+str(len(self.segments)))
+                                        video = open(name+".h264", "wb")
+                                        index = open(name+".idx", "w")
+                                        self.segments.append(name+".h264")
+                                if iFrame:
+                                        index.write(str(video.tell())+" "+str(timestamp)+" "+str(frameNumber)+"\n")
+                                        index.flush()
+                                video.write(payload)
+                                self.frames += 1
+                        except (IOError, OSError) as error:
+                                print "VideoRecorder :      recording stopped, "+str(error)
+                                self.failed = error
+                                for f in (video, index):
+                                        try:
+                                                if f: f.close()
+                                        except (IOError, OSError): pass
+                                video, index = None, None
+                                if payload is None: break
+
+##### Frame-sender ############################################################
+# Hands the frames from the network-loop to the videodecode-process via a bounded queue and a thread of its own, so a
+#   slow or hung decoder never holds up video reception. When the queue overflows, P-frames are dropped up to the next
+#   I-frame, like VideoRecorder does. A new decoder first gets FRAMESENDER_START, and ignores whatever came before it.
+FRAMESENDER_START = "start"
+
+class FrameSender(object):
+        def __init__(self, pipe, queueSize=32):
+                self.dropped =          0
+                self.__pipe =           pipe
+                self.__queue =          Queue.Queue(queueSize)
+                self.__waitKey =        True                                                    # Skip frames till the next I-frame
+                self.__stop =           object()
+                self.__thread =         threading.Thread(target=self.__sender)
+                self.__thread.daemon = True
+                self.__thread.start()
+
+        def send(self, header, payload):  # Returns False if the frame was dropped
+                iFrame = header.frameType in PaVE_KEYFRAMES
+                if self.__waitKey and not iFrame: return False
+                try:
+                        self.__queue.put_nowait((header, payload, time.time()))
+                        self.__waitKey = False
+                        return True
+                except Queue.Full:
+                        self.dropped += 1
+                        self.__waitKey = True
+                        return False
+
+        def restart(self):  # For a new decoder: frames queued for the old one are thrown away, the stream begins at an I-frame
+                self.__clear()
+                self.__waitKey = True
+                self.__queue.put(FRAMESENDER_START)
+
+        def stop(self):
+                self.__clear()
+                self.__queue.put(self.__stop)
+
+        def __clear(self):
+                try:
+                        while True: self.__queue.get_nowait()
+                except Queue.Empty: pass
+
+        def __sender(self):
+                while True:
+                        item = self.__queue.get()
+                        if item is self.__stop: break
+                        try: self.__pipe.send(item)
+                        except (IOError, EOFError, OSError): self.dropped += 1     # Decoder gone, a new one gets a restart()
+
+def readVideoIndex(path):  # Returns [(byte-offset, PaVE-timestamp, frame-number), ...] of the I-frames of a recorded segment
+        index = []
+        for line in open(os.path.splitext(path)[0]+".idx"):
+                index.append(tuple(int(value) for value in line.split()))
+        return index
+
+def sliceVideo(path, fromTime, toTime, outPath):  # Copies the frames of a segment between two PaVE-timestamps (ms), starting at an I-frame
+        index = readVideoIndex(path)
+        start = [entry[0] for entry in index if entry[1] <= fromTime]
+        end =   [entry[0] for entry in index if entry[1] > toTime]
+        video, out = open(path, "rb"), open(outPath, "wb")
+        if start: video.seek(start[-1])
+        if end: out.write(video.read(end[0]-video.tell()))
+        else:   out.write(video.read())
+        video.close()
+        out.close()
+
 # If the ps_drone-process has crashed, recognize it and kill yourself
 def watchdogV(parentPID, ownPID):
         global commitsuicideV
@@ -1023,9 +1523,9 @@ def watchdogV(parentPID, ownPID):
                         try: subprocess.Popen(["kill",str(os.getpid())],stdin=subprocess.PIPE,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
                         except: pass
 
-# Thread to capture, decode and display the video-stream                        
-def vCapture(VidPipePath, parent_pipe):
-        import cv2
+# Thread to decode and display the video-stream
+def vCapture(frame_pipe, ring, previewRing, parent_pipe, metrics):
+        import av, cv2
         global vCruns, commitsuicideV, showVid, lockV, debugV
 
         show = False
@@ -1033,84 +1533,78 @@ def vCapture(VidPipePath, parent_pipe):
         vCruns = True
         t = time.time()
         parent_pipe.send(("VideoUp",0,0,0))
-        capture = cv2.VideoCapture(VidPipePath)
+        codec = av.CodecContext.create("h264", "r")                             # The stream is always H.264, nothing to guess
         ImgCount = 0
-        if debugV: print "CAPTURE: "+str(time.time()-t)
-        time.sleep(0.2)
-        parent_pipe.send(("foundCodec",0,0,0))
-        time.sleep(0.2)
-        declag = time.time()
-        count =         -3
         imageXsize = 0
         imageYsize = 0
         windowName = "PS-Drone"
-        codecOK = False
-        lastKey =       ""
-        cc=0
+        receiveWatchdog = ProgressWatchdog(2.0, VideoReceiveWatchdog, [parent_pipe,"vCapture", debugV]) # Resets video if something hangs
+        started = False                                                                         # Frames before FRAMESENDER_START were meant for an earlier decoder
 
         while not commitsuicideV:
+                if showVid:                                                             # Before any skip, so toggling works without frames too
+                        if not show:
+                                show=True
+                                cv2.destroyAllWindows()
+                else:
+                        if show:
+                                show=False
+                                cv2.destroyAllWindows()
+                if not frame_pipe.poll(0.1): continue
+                message = frame_pipe.recv()
+                if message == FRAMESENDER_START: started = True
+                if not started or message == FRAMESENDER_START: continue
+                header, payload, sent = message
+                receiveWatchdog.progress()
                 decTimeRev = time.time()
-                receiveWatchdog = threading.Timer(2.0, VideoReceiveWatchdog, [parent_pipe,"vCapture", debugV]) # Resets video if something hangs
-                receiveWatchdog.start()
-                success, image = capture.read()
-                cc      +=1
-                receiveWatchdog.cancel()
-                decTime =               decTimeRev-time.time()
-                tlag =                  time.time()-declag
-
-                if not codecOK and success:
-                        try:
-                                if image.shape[:2]==(360,640) or image.shape[:2]==(368,640) or image.shape[:2]==(720,1280) or image.shape[:2]==(1080,1920):
-                                        codecOK = True
-                                        if debugV: print "Codec seems OK"
-                                else:
-                                        if debugV: print "Codec failure"
-                                        parent_pipe.send(("reset",0,0,0))
-                                        commitsuicideV = True
-                        except:
-                                        if debugV: print "Codec failure"
-                                        parent_pipe.send(("reset",0,0,0))
-                                        commitsuicideV = True
-                if codecOK:
+                metrics.record("ipc", decTimeRev-sent, max(metrics.count("assemble")-metrics.count("ipc")-1, 0))
+                try: frames = codec.decode(av.Packet(payload))
+                except av.AVError:
+                        if debugV: print "Could not decode frame",header.frameNumber
+                        metrics.drop("decode")
+                        continue
+                for frame in frames:
+                        image =         frame.to_ndarray(format="bgr24")
+                        decTime =       time.time()-decTimeRev
+                        metrics.record("decode", decTime)
+                        ImgCount+=1
+                        if debugV and ImgCount==1: print "First image after "+str(time.time()-t)
                         if not (imageXsize == image.shape[1]) or not (imageYsize == image.shape[0]):
                                 cv2.destroyAllWindows()
                                 imageYsize, imageXsize = image.shape[:2]
                                 windowName = "PS-Drone - "+str(imageXsize)+"x"+str(imageYsize)
-                        if success:
-                                if tlag > 0.02: count+=1
-                                if count > 0:
-                                        ImgCount+=1
-                                        if not show and not hide:
-                                                cv2.destroyAllWindows()
-                                                hide = True
-                                        if show:
-                                                cv2.imshow(windowName, image)
-                                                key=cv2.waitKey(1)
-                                                if key>-1: parent_pipe.send(("keypressed",0,chr(key%256),0))
-                                        parent_pipe.send(("Image",ImgCount,image,decTime))
-                        else: time.sleep(0.01)
-                        declag = time.time()
-
-                        if showVid:
-                                if not show:
-                                        show=True
-                                        cv2.destroyAllWindows()
-                        else:
-                                if show:
-                                        show=False
-                                        cv2.destroyAllWindows()
+                        if not show and not hide:
+                                cv2.destroyAllWindows()
+                                hide = True
+                        if show:
+                                cv2.imshow(windowName, image)
+                                key=cv2.waitKey(1)
+                                if key>-1: parent_pipe.send(("keypressed",0,chr(key%256),0))
+                        slot = ring.write(image, ImgCount, header.timestamp, decTime, sent)
+                        if imageXsize > PREVIEW_WIDTH or imageYsize > PREVIEW_HEIGHT:                 # HD: scale down for displays
+                                scale = min(float(PREVIEW_WIDTH)/imageXsize, float(PREVIEW_HEIGHT)/imageYsize)
+                                preview = cv2.resize(image, (int(imageXsize*scale), int(imageYsize*scale)), interpolation=cv2.INTER_AREA)
+                        else: preview = image
+                        previewSlot = previewRing.write(preview, ImgCount, header.timestamp, decTime, sent)
+                        if slot < 0:
+                                if debugV: print "Image does not fit into the frame-ring:",image.shape
+                                metrics.drop("decode")
+                        else: parent_pipe.send(("Image",ImgCount,(slot,previewSlot),decTime))
+
         vCruns = False
+        receiveWatchdog.stop()
         cv2.destroyAllWindows()
-        capture.release()
-        if debugV: print "vCapture-Thread :    committed suicide"
-
-### Process to decode the videostream in the FIFO-Pipe, stored there from main-loop.
-# Storing and decoding must not be processed in the same process, thats why decoding is external.
-# vDecode controls the vCapture-thread which captures and decodes finally the videostream.
-def vDecode(VidPipePath, parent_pipe, parentPID):
+        if debugV:
+                print "vCapture-Thread :    committed suicide"
+                print "vCapture-Thread :    "+str(receiveWatchdog.stalls)+" stalls, longest "+str(receiveWatchdog.longestStall)+"s"
+
+### Process to decode the videostream, whose frames are sent by the main-loop through frame_pipe.
+# Receiving and decoding are not processed in the same process, so decoding never holds up the network.
+# vDecode controls the vCapture-thread which decodes the videostream finally.
+def vDecode(frame_pipe, ring, previewRing, parent_pipe, metrics, parentPID):
         global vCruns, commitsuicideV, showVid, lockV, debugV
         showCommands = False
-        Thread_vCapture = threading.Thread(target=vCapture, args=(VidPipePath,parent_pipe))
+        Thread_vCapture = threading.Thread(target=vCapture, args=(frame_pipe,ring,previewRing,parent_pipe,metrics))
         Thread_vCapture.start()
         Thread_watchdogV = threading.Thread(target=watchdogV, args=[parentPID,os.getpid()])
         Thread_watchdogV.start()
@@ -1140,23 +1634,26 @@ def VideoReceiveWatchdog(parent_pipe,name, debugV):
         if debugV: print "WHATCHDOG reset von",name
         parent_pipe.send(("reset",0,0,0))
 
-def mainloopV(DroneIP, VideoPort, VidPipePath, parent_pipe, parentPID):
+def mainloopV(DroneIP, VideoPort, frame_pipe, parent_pipe, metrics, parentPID):
         inited, preinited, suicide, debugV, showCommands, slowVideo = False, False, 0, False, False, False
-        rawVideoFrame, VidStreamSnippet, VidStreamSnippetAvalible, iFrame, lastIFrame = "", "", False, False, False
-        saveVideo, unsureMode, searchCodecTime, frameRepeat, burstFrameCount = False, True, 0, 1, 0
-        FrameCount, reset, resetCount, commitsuicideV, foundCodec = 0,False, 0, False, False
+        assembler, iFrame =     PaVEAssembler(), False
+        recorder =                      None
+        sender =                        FrameSender(frame_pipe)                        # Never blocks this loop
+        saveVideo, unsureMode = False, True
+        FrameCount, reset, resetCount, commitsuicideV = 0,False, 0, False
 
         vstream_pipe, pipes = None, [parent_pipe]
-        vdecode_pipe, vdecode_childpipe = multiprocessing.Pipe()
-        pipes.append(vdecode_pipe)
+        watchdog_pipe, watchdog_childpipe = multiprocessing.Pipe()
+        pipes.append(watchdog_pipe)
+        receiveWatchdog = ProgressWatchdog(2.0, watchdog_childpipe.send, ["reset"], False) # Resets video if the stream hangs
         Thread_watchdogV = threading.Thread(target=watchdogV, args=[parentPID,os.getpid()])
         Thread_watchdogV.start()
 
         while not commitsuicideV:
                 in_pipe, out_pipe, dummy2 = select.select(pipes, [], [], 0.1)    # When something is in a pipe...
                 for ip in in_pipe: 
-                        if ip == parent_pipe:
-                                cmd = parent_pipe.recv()
+                        if ip == parent_pipe or ip == watchdog_pipe:
+                                cmd = ip.recv()
                                 if showCommands: print "** Com -> Vid : ",cmd
                                 if cmd == "die!":
                                         if inited:
@@ -1164,34 +1661,32 @@ def mainloopV(DroneIP, VideoPort, VidPipePath, parent_pipe, parentPID):
                                                 parent_pipe.send("vDecProcKill")
                                                 dummy = 0
                                         else: commitsuicideV = True
-                                elif cmd == "foundCodec":
-                                        foundCodec              = True
-                                        burstFrameCount = 0
                                 elif cmd == "reset" and not reset:# and resetCount<3:
-                                        inited, preinited, foundCodec   = False, False, False
-                                        rawVideoFrame, VidStreamSnippet = "", ""
-                                        VidStreamSnippetAvalible                = False
-                                        iFrame, lastIFrame                              = False, False
-                                        FrameCount, reset                               = False, 0, True
-                                        unsureMode, searchCodecTime             = True, 0
-                                        burstFrameCount                                 = 0
+                                        if debugV and ip == watchdog_pipe: print "WHATCHDOG reset von Video Mainloop"
+                                        receiveWatchdog.disarm()
+                                        inited, preinited                               = False, False
+                                        assembler.reset()
+                                        iFrame                                                  = False
+                                        FrameCount, reset                               = 0, True
+                                        unsureMode                                              = True
                                         resetCount                                              += 1
                                         parent_pipe.send("vDecProcKill")
-                                elif cmd == "slowVideo":
+                                elif cmd == "slowVideo" or cmd == "midVideo":   # Decoded frames come out at once, no need to repeat I-frames in midVideo-mode
                                         slowVideo = True
-                                        frameRepeat = 1
-                                elif cmd == "midVideo":
-                                        slowVideo = True
-                                        frameRepeat = 5
                                 elif cmd == "fastVideo":
                                         slowVideo = False
-                                        frameRepeat = 1
                                 elif cmd == "saveVideo":
                                         saveVideo = True
                                         parent_pipe.send("saveVideo")
                                 elif cmd == "unsaveVideo":
                                         saveVideo = False
                                         parent_pipe.send("unsaveVideo")
+                                elif type(cmd) == tuple and cmd[0] == "record":
+                                        if recorder: recorder.stop()
+                                        recorder = VideoRecorder(cmd[1], cmd[2])
+                                elif cmd == "unrecord":
+                                        if recorder: recorder.stop()
+                                        recorder = None
                                 elif cmd == "showCommands":
                                         showCommands = True
                                         parent_pipe.send("showCommands")
@@ -1207,30 +1702,20 @@ def mainloopV(DroneIP, VideoPort, VidPipePath, parent_pipe, parentPID):
                                         parent_pipe.send("undebug")
                                 elif cmd == "init" and not inited and not preinited:
                                         preinited = True
-                                        try:
-                                                os.mkfifo(VidPipePath)
-                                                os.chmod(VidPipePath, 1411)      # dec => oct : 777 => 1411 | 666 => 1232
-                                        except:
-                                                saveVideo = True                                         # ... fall back to savemode
-                                                parent_pipe.send("saveVideo")            # Inform the main process
-                                                unsureMode = False
-                                                foundCodec = True       
                                         parent_pipe.send("vDecProc")
                                 elif cmd == "vDecProcON":
-                                        rawVideoFrame           = ""
-                                        VidStreamSnippet        = ""
-                                        iFrame, lastIFrame      = False, False
+                                        sender.restart()
+                                        assembler.reset()
+                                        iFrame                          = False
                                         FrameCount                      = 0
-                                        foundCodec                      = False
-                                        searchCodecTime         = 0
                                         if not vstream_pipe:
                                                 vstream_pipe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                                                 vstream_pipe.setblocking(0)
                                                 vstream_pipe.connect_ex((DroneIP,VideoPort))
                                                 pipes.append(vstream_pipe)
-                                        write2pipe = open(VidPipePath,"w+")
                                         suicide = False
                                         inited = True
+                                        receiveWatchdog.arm()
                                         preinited = False
                                         unsureMode = True
                                 elif cmd == "uninit" and inited:
@@ -1240,129 +1725,54 @@ def mainloopV(DroneIP, VideoPort, VidPipePath, parent_pipe, parentPID):
                                                 pipes.remove(vstream_pipe)
                                                 vstream_pipe.shutdown(socket.SHUT_RDWR)
                                                 vstream_pipe.close()
-                                                write2pipe.close()
+                                                vstream_pipe = None
                                                 inited = False
+                                                receiveWatchdog.disarm()
                                                 if suicide: commitsuicideV = True
                                                 parent_pipe.send("VideoDown")
-                                        try: os.remove(VidPipePath)
-                                        except: pass
                                         if not inited and reset:
-                                                try:
-                                                        os.mkfifo(VidPipePath)
-                                                        os.chmod(VidPipePath, 1411)      # dec => oct : 777 => 1411 | 666 => 1232
-                                                except:
-                                                        saveVideo = True                                         # ... fall back to savemode
-                                                        parent_pipe.send("saveVideo")            # Inform the main process
-                                                        unsureMode = False
-                                                        foundCodec = True       
                                                 parent_pipe.send("VideoDown")
                                                 parent_pipe.send("vDecProc")
                                                 parent_pipe.send("debug")
                                                 reset =   False
-                                                burstFrameCount = 0
                                 else:
                                         parent_pipe.send(cmd)
 
-                 ### Grabs the Videostream and store it in a fifo-pipe for decoding.
-                 # The decoder has to guess the videostream-format which takes around 266 video-frames.
-                 #    So the stream is preprocessed, I-Frames will cut out while initiation and a flood of copies 
-                 #       will be send to the decoder, till the proper decoder for the videostream is found.
-                 # In case of a slow or midspeed-video, only a single or a few copied I-frames are sent to the decoder.
+                 ### Grabs the Videostream and hands it over to the decoder.
+                 # The PaVE-headers tell where frames start and of which type they are, so the H.264-payload of each frame
+                 #    goes straight to the decoder, beginning with an I-frame. No codec has to be guessed.
+                 # In case of a slow or midspeed-video, only the I-frames are sent to the decoder.
+                 # In savemode every frame is sent as it comes, without any preprocessing.
                         if ip == vstream_pipe:
-                                receiveWatchdog = threading.Timer(2.0, VideoReceiveWatchdog, [parent_pipe,"Video Mainloop", debugV,]) # Resets video if something hangs
-                                receiveWatchdog.start()
-                                videoPackage    = vstream_pipe.recv(65535)
-                                receiveWatchdog.cancel()
-                                lenVideoPackage =len(videoPackage)
+                                received = time.time()
+                                lenVideoPackage = assembler.recvFrom(vstream_pipe)
+                                receiveWatchdog.progress()
+                                metrics.record("receive", time.time()-received, assembler.pending())
+                                received = time.time()
                                 if lenVideoPackage == 0: commitsuicideV = True
+                                elif not inited or reset: assembler.reset()                             # Nobody wants the stream yet
                                 else:
-                                        if inited and not reset:
-                                         ### Analyze raw datastream
-                                                frameStart = False
-                                                if not saveVideo and lenVideoPackage>45 and videoPackage[36:40]=="\x00\x00\x00\x00" and videoPackage[41:44]=="\x00\x01\x00":
-                                                        frameStart              = True
-                                                        rawVideoFrame   = VidStreamSnippet
-                                                        lastIFrame              = iFrame
-                                                        if videoPackage[30] == "\x01":  # I-Frame
-                                                                iFrame, unsureMode      = True, False
-                                                                VidStreamSnippet        = videoPackage
-                                                                FrameCount += 1
-                                                        elif videoPackage[30] == "\x03":  # P-Frame
-                                                                iFrame = False
-                                                                if not unsureMode:
-                                                                        if foundCodec: VidStreamSnippet = videoPackage
-#                                                                       else: VidStreamSnippet   += videoPackage
-                                                                FrameCount += 1
-                                                        else: 
-                                                                iFrame                          = False
-                                                                VidStreamSnippet        = videoPackage
-                                                                if debugV:
-                                                                        print "*** Odd h264 Frametype: ",FrameCount,
-                                                                        print videoPackage[30:50].encode("hex")
-                                                                        print " - ",videoPackage[31:40].find("\x00\x00\x00"),ord(videoPackage[30])
-                                                elif not unsureMode:
-                                                        VidStreamSnippet+=videoPackage   # Merging video-snippets
-
-
-                                         ### Procress last frame
-                                         # An MPEG4-Stream is not confirmed. Boost or fallback to savemode.
-                                                lenRawVideoFrame        = len(rawVideoFrame)
-
-#                                               print slowVideo, frameStart, saveVideo, foundCodec, lenRawVideoFrame
-
-                                                if not saveVideo and unsureMode and frameStart and lastIFrame and lenRawVideoFrame>0:
-                                                        if not searchCodecTime: 
-                                                                searchCodecTime = time.time()            # Video is freshly initiated
-                                                        elif (time.time()-searchCodecTime) > 2.0: # Waited too long for an MPEG4 stream confirmation...
-                                                                saveVideo = True                                         # ... fall back to savemode
-                                                                parent_pipe.send("saveVideo")            # Inform the main process
-                                                                unsureMode = False
-                                                                foundCodec = True                                        # switch off codec guess speed-up
-                                                elif not saveVideo and frameStart and not unsureMode and not foundCodec and lenRawVideoFrame>0:
-                                                 # Boost Frames
-                                                        boost=((1024*512)/len(VidStreamSnippet))+1
-#                                                       print "Boost IN", len(VidStreamSnippet)
-                                                        for i in range(0,boost):
-                                                                try: write2pipe.write(rawVideoFrame)
-                                                                except: print "Boost ERROR"
-                                                        burstFrameCount+=1
-                                                 # Give up after to much tries
-                                                        if burstFrameCount>10: 
-                                                                parent_pipe.send(("reset",0,0,0))
-                                                                time.sleep(0.2)
-                                                                burstFrameCount=0
-                                                                if debugV: print "To many pictures send while guessing the codec. Resetting."
-
-                                         # Normal Pipeing
-                                                elif not slowVideo and frameStart and (saveVideo or foundCodec) and lenRawVideoFrame>0:
-                                                        if burstFrameCount==0 and lastIFrame: burstFrameCount = 1
-                                                        if burstFrameCount==1:
-                                                                try: write2pipe.write(rawVideoFrame)
-                                                                except: print "Pipe Error"
-
-                                         # Just show the I-Frame for slow-video-mode (and repeat for less delay in midVideo()-mode)
-                                                elif not saveVideo and foundCodec and slowVideo and lastIFrame and lenRawVideoFrame>0:
-                                                        for i in range(0,frameRepeat): write2pipe.write(rawVideoFrame)  
-                                         # Save-Mode
-                                                elif saveVideo: write2pipe.write(videoPackage)
+                                        for header, rawVideoFrame in assembler.frames():
+                                                FrameCount += 1
+                                                iFrame = header.frameType in PaVE_KEYFRAMES
+                                                if iFrame: unsureMode = False                                   # Decoding can start with this frame
+                                                elif header.frameType != PaVE_FRAME_P and debugV:
+                                                        print "*** Odd h264 Frametype: ",FrameCount,header.frameType
+                                                decode = saveVideo or (not unsureMode and (iFrame or not slowVideo))
+                                                if decode or recorder: payload = rawVideoFrame.tobytes()
+                                                if recorder: recorder.write(header, payload)            # Full stream, whatever is decoded
+                                                if decode and sender.send(header, payload):
+                                                        metrics.record("assemble", time.time()-received)
+                                                else: metrics.drop("assemble")                                  # Left out: before the first I-frame, slow video or the decoder lags behind
 
 
         try:
                 vstream_pipe.shutdown(socket.SHUT_RDWR)
                 vstream_pipe.close()
         except: pass
-        try: write2pipe.close()
-        except: pass
-        try: vstream_pipe.close()
-        except: pass
-        try:
-                VidPipe=open(VidPipePath,"r")
-                r = "1"
-                while len(r): r=VidPipe.read()
-                FIFO.close()
-        except: pass
-        try: os.remove(VidPipePath)
-        except: pass
+        receiveWatchdog.stop()
+        sender.stop()
+        if recorder: recorder.stop()
         if debugV: print "Video-Process :      committed suicide"
         try: vstream_pipe.close()
         except: pass
@@ -0,0 +1,144 @@
+"""Registry of the orchard's trees with fast spatial lookups.
+
+   Trees are kept in a uniform grid over local (east, north) meters,
+   about one tree per cell, stored sorted by cell with an index of where
+   every cell starts. A query only looks at the cells around it, so it
+   costs the same for a hundred trees as for a hundred thousand."""
+import csv, json, math
+import numpy as np
+import geo
+
+class TreeRegistry:
+    """Tree ids and positions with nearest, radius and polygon queries.
+       Positions are [lat, lon] in degrees, distances in meters."""
+
+    def __init__(self, ids, lats, lons, enu=None, cell=None):
+        """enu: geo.LocalProjection to work in (default: around the
+           trees), cell: grid cell size in m (default: one tree per cell
+           on average)."""
+        self.ids = np.asarray(ids)
+        self.gps = np.column_stack((lats, lons)).astype(float)
+        if not len(self.ids): raise ValueError("No trees to register")
+        if enu is None: enu = geo.LocalProjection(*self.gps.mean(axis=0))
+        self.__enu = enu
+        xy = np.column_stack(enu.to_local(self.gps[:, 0], self.gps[:, 1]))
+
+        # Grid over the trees' bounding box
+        self.__low = xy.min(axis=0)
+        span = xy.max(axis=0) - self.__low
+        if cell is None:
+            cell = max(math.sqrt(span[0] * span[1] / len(xy)), span.max() / len(xy), 1.0)
+        self.__cell = float(cell)
+        self.__nx, self.__ny = (span // self.__cell).astype(int) + 1
+
+        # Trees sorted by cell, row by row; a cell's trees are
+        #  [starts[c], starts[c + 1]), a row of cells is one slice
+        cx, cy = ((xy - self.__low) // self.__cell).astype(int).T
+        key = cy * self.__nx + cx
+        order = np.argsort(key, kind="mergesort")
+        self.__xy, self.__order = xy[order], order
+        self.__starts = np.searchsorted(key[order], np.arange(self.__nx * self.__ny + 1))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __cell_of(self, x, y):
+        """Grid cell of (x, y), None if it is not a finite position."""
+        if not (np.isfinite(x) and np.isfinite(y)): return None
+        return (int((x - self.__low[0]) // self.__cell),
+                int((y - self.__low[1]) // self.__cell))
+
+    def __block(self, x0, x1, y0, y1):
+        """Sorted positions of the trees in cells x0..x1, y0..y1."""
+        x0, x1 = max(x0, 0), min(x1, self.__nx - 1)
+        y0, y1 = max(y0, 0), min(y1, self.__ny - 1)
+        if x0 > x1 or y0 > y1: return np.zeros(0, int)
+        rows = np.arange(y0, y1 + 1) * self.__nx
+        lo, hi = self.__starts[rows + x0], self.__starts[rows + x1 + 1]
+        return np.concatenate([np.arange(a, b) for a, b in zip(lo, hi)])
+
+    def nearest(self, lat, lon):
+        """(id, distance) of the tree closest to (lat, lon), None if
+           that is not a finite position (e.g. no GPS fix)."""
+        x, y = self.__enu.to_local(lat, lon)
+        cell = self.__cell_of(x, y)
+        if cell == None: return None
+        cx, cy = cell
+
+        # Grow a square of cells until nothing outside can be closer:
+        #  trees beyond ring r are at least r cells away
+        r = max(0, -cx, cx - self.__nx + 1, -cy, cy - self.__ny + 1)
+        while True:
+            idx = self.__block(cx - r, cx + r, cy - r, cy + r)
+            if len(idx):
+                d = np.hypot(self.__xy[idx, 0] - x, self.__xy[idx, 1] - y)
+                best = np.argmin(d)
+                if d[best] <= r * self.__cell: break
+            r += 1
+        return self.ids[self.__order[idx[best]]], float(d[best])
+
+    def within(self, lat, lon, radius):
+        """(ids, distances) of the trees at most radius from (lat, lon),
+           closest first. None if (lat, lon) is not a finite position."""
+        x, y = self.__enu.to_local(lat, lon)
+        low, high = self.__cell_of(x - radius, y - radius), self.__cell_of(x + radius, y + radius)
+        if low == None or high == None: return None
+        idx = self.__block(low[0], high[0], low[1], high[1])
+        d = np.hypot(self.__xy[idx, 0] - x, self.__xy[idx, 1] - y)
+        near = np.argsort(d)
+        near = near[d[near] <= radius]
+        return self.ids[self.__order[idx[near]]], d[near]
+
+    def in_polygon(self, polygon):
+        """Ids of the trees inside polygon (list of [lat, lon] in order),
+           None if any vertex is not a finite position."""
+        vrts = np.asarray(polygon, float).reshape(-1, 2)
+        poly = np.column_stack(self.__enu.to_local(vrts[:, 0], vrts[:, 1]))
+        if not np.isfinite(poly).all(): return None
+        (x0, y0), (x1, y1) = self.__cell_of(*poly.min(axis=0)), self.__cell_of(*poly.max(axis=0))
+        idx = self.__block(x0, x1, y0, y1)
+
+        # Even-odd rule: count edges crossed by a ray towards +x
+        px, py = self.__xy[idx, 0][:, None], self.__xy[idx, 1][:, None]
+        a, b = poly, np.roll(poly, -1, axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            at = a[:, 0] + (py - a[:, 1]) * (b[:, 0] - a[:, 0]) / (b[:, 1] - a[:, 1])
+        crossed = ((a[:, 1] > py) != (b[:, 1] > py)) & (px < at)
+        inside = crossed.sum(axis=1) % 2 == 1
+        return self.ids[np.sort(self.__order[idx[inside]])]
+
+def _column(names, *options):
+    for name in options:
+        if name in names: return names[name]
+    return None
+
+def load(path, enu=None, cell=None):
+    """TreeRegistry of a CSV file with a header (id, lat and lon columns,
+       also as tree_id/latitude/lng/longitude) or of a GeoJSON file of
+       Point features (id from the feature or its properties). Trees
+       without an id are numbered in file order."""
+    ids, lats, lons = [], [], []
+    if path.lower().endswith((".json", ".geojson")):
+        with open(path) as f: features = json.load(f)["features"]
+        for i, feature in enumerate(features):
+            if feature["geometry"]["type"] != "Point": continue
+            lon, lat = feature["geometry"]["coordinates"][:2]
+            props = feature.get("properties") or {}
+            ids.append(feature.get("id", props.get("id", i)))
+            lats.append(lat)
+            lons.append(lon)
+    else:
+        with open(path) as f:
+            reader = csv.reader(f)
+            names = dict((name.strip().lower(), i) for i, name in enumerate(next(reader)))
+            c_id = _column(names, "id", "tree_id", "tree")
+            c_lat = _column(names, "lat", "latitude")
+            c_lon = _column(names, "lon", "lng", "long", "longitude")
+            if c_lat is None or c_lon is None:
+                raise ValueError("{}: no lat/lon columns".format(path))
+            for i, row in enumerate(reader):
+                if not row: continue
+                ids.append(row[c_id] if c_id is not None else i)
+                lats.append(float(row[c_lat]))
+                lons.append(float(row[c_lon]))
+    return TreeRegistry(ids, lats, lons, enu, cell)
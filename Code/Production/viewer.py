@@ -1,6 +1,176 @@
-import cv2
+import cv2, time
 import numpy as np
-from threading import Thread
+from threading import Thread, Condition
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+class FrameMailbox:
+    """Hands frames from a producer thread to one consumer under an
+       explicit delivery policy, and accounts for every frame:
+         LATEST - only the newest frame is kept, older ones are dropped
+         QUEUE  - up to 'size' frames are kept; with put(block=True) the
+                  producer waits for room instead of dropping the oldest
+         NTH    - only every 'nth' produced frame is delivered (latest-wins)"""
+    LATEST, QUEUE, NTH = "latest", "queue", "nth"
+
+    def __init__(self, policy=LATEST, size=4, nth=1):
+        self.__policy = policy
+        self.__nth = max(1, nth)
+        self.__frames = deque()
+        self.__size = size if policy == self.QUEUE else 1
+        self.__cond = Condition()
+        self.__ages = deque(maxlen=100) # Recent frame ages at consumption
+        self.produced, self.consumed, self.dropped = 0, 0, 0
+
+    def put(self, frame, block=False, timeout=None, frame_id=None):
+        """Offer a frame, returns False if it was not accepted. Frames
+           are numbered by the producer's frame_id if given, else by
+           the mailbox itself."""
+        with self.__cond:
+            self.produced += 1
+            if self.__policy == self.NTH and (self.produced - 1) % self.__nth:
+                self.dropped += 1
+                return False
+            if block and self.__policy == self.QUEUE:
+                # Backpressure: wait for the consumer to make room
+                end = None if timeout is None else time.time() + timeout
+                while len(self.__frames) >= self.__size:
+                    left = None if end is None else end - time.time()
+                    if left is not None and left <= 0: break
+                    self.__cond.wait(left)
+            while len(self.__frames) >= self.__size:
+                self.__frames.popleft()
+                self.dropped += 1
+            if frame_id is None: frame_id = self.produced
+            self.__frames.append((time.time(), frame_id, frame))
+            self.__cond.notify_all()
+            return True
+
+    def get(self, timeout=0):
+        """Take the next frame as (frame id, frame), or None if there is
+           none within timeout seconds."""
+        with self.__cond:
+            if not self.__frames and timeout != 0: self.__cond.wait(timeout)
+            if not self.__frames: return None
+            stamp, frame_id, frame = self.__frames.popleft()
+            self.consumed += 1
+            self.__ages.append(time.time() - stamp)
+            self.__cond.notify_all()
+        return frame_id, frame
+
+    def stats(self):
+        """Counters and ages (seconds) of recently consumed frames."""
+        with self.__cond:
+            ages = list(self.__ages)
+            return {"policy": self.__policy,
+                    "produced": self.produced,
+                    "consumed": self.consumed,
+                    "dropped": self.dropped,
+                    "pending": len(self.__frames),
+                    "age_avg": np.mean(ages) if ages else 0.0,
+                    "age_max": max(ages) if ages else 0.0}
+
+def hue_intervals(low, high):
+    """One or two [low, high] intervals within 0-179 covering the hue
+       range low..high, which may wrap around 0."""
+    if high - low >= 179: return [(0, 179)]
+    low, high = low % 180, high % 180
+    if low <= high: return [(low, high)]
+    return [(low, 179), (0, high)]
+
+def hsv_range(bgr, hue_tol=10):
+    """(low, high) HSV range around a BGR colour, for ColorClassifier.
+       Bounds are ints, so the hue range of reds reaches below 0."""
+    hue = int(cv2.cvtColor(np.uint8([[bgr]]), cv2.COLOR_BGR2HSV)[0, 0, 0])
+
+    # Low for dark/shady lighting, high for light/bright
+    return (np.array([hue - hue_tol, 75, 75]), np.array([hue + hue_tol, 255, 255]))
+
+class ColorClassifier:
+    """Labels every pixel of an HSV frame with the first of up to 16
+       (low, high) HSV ranges it falls into, in one pass. The
+       (H,S,V) -> colours table of box-shaped ranges is separable, so
+       it is kept as one bitmask table per channel: a frame costs three
+       table lookups and an AND however many colours are configured.
+       Hue ranges wrap around (OpenCV hue is 0-179), so reds work:
+       a range may reach below 0 or above 179, or have low > high."""
+    MAX_COLORS = 16
+
+    def __init__(self, ranges):
+        if len(ranges) > self.MAX_COLORS:
+            raise ValueError("at most {} colors".format(self.MAX_COLORS))
+        self.__tables = np.zeros((3, 256), np.uint16) # H, S, V bitmasks
+        for i, (low, high) in enumerate(ranges):
+            bit = 1 << i
+            for hues in hue_intervals(int(low[0]), int(high[0])):
+                self.__tables[0, hues[0]:hues[1] + 1] |= bit
+            self.__tables[1, max(0, int(low[1])):int(high[1]) + 1] |= bit
+            self.__tables[2, max(0, int(low[2])):int(high[2]) + 1] |= bit
+
+        # Bitmask -> label of its lowest colour bit (1-based, 0 = none)
+        self.__labels = np.zeros(1 << len(ranges), np.uint8)
+        for i in reversed(range(len(ranges))):
+            self.__labels[(np.arange(len(self.__labels)) >> i) & 1 == 1] = i + 1
+
+    def classify(self, img_hsv):
+        """Returns the combined mask (0/255) and the label image
+           (0 = no colour, n = n'th range) of an 8-bit HSV frame."""
+        bits = np.take(self.__tables[0], img_hsv[:, :, 0])
+        bits &= np.take(self.__tables[1], img_hsv[:, :, 1])
+        bits &= np.take(self.__tables[2], img_hsv[:, :, 2])
+        labels = np.take(self.__labels, bits)
+        mask = np.where(labels > 0, np.uint8(255), np.uint8(0))
+        return mask, labels
+
+# One record per detected blob: centroid and area of its contour polygon,
+#  bounding box, convex hull (Nx1x2 int32, frame coordinates) and the
+#  1-based index of its color in the camera's color definitions (0 = none)
+DETECTION = np.dtype([("cx", np.float32), ("cy", np.float32),
+        ("area", np.float32), ("x", np.int32), ("y", np.int32),
+        ("w", np.int32), ("h", np.int32), ("label", np.uint8),
+        ("hull", object)])
+
+def describe_blobs(cnts, labels):
+    """Builds the DETECTION record array of a frame's contours. Areas
+       and centroids are the polygon moments of all contours at once
+       (the shoelace sums, split per contour with reduceat), labels are
+       the most common color under each contour in the label image."""
+    n = len(cnts)
+    if not n: return np.zeros(0, DETECTION)
+    sizes = np.array([len(c) for c in cnts])
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    pts = np.concatenate(cnts).reshape(-1, 2)
+    x, y = pts[:, 0].astype(np.float64), pts[:, 1].astype(np.float64)
+
+    # Next vertex of every vertex, wrapping around inside its contour
+    nxt = np.arange(len(pts)) + 1
+    nxt[starts + sizes - 1] = starts
+    cross = x * y[nxt] - x[nxt] * y
+    area = np.add.reduceat(cross, starts) / 2.0
+    flat = np.abs(area) < 1e-9 # Lines and points: mean of the vertices
+    safe = np.where(flat, 1.0, 6.0 * area)
+    cx = np.where(flat, np.add.reduceat(x, starts) / sizes,
+            np.add.reduceat((x + x[nxt]) * cross, starts) / safe)
+    cy = np.where(flat, np.add.reduceat(y, starts) / sizes,
+            np.add.reduceat((y + y[nxt]) * cross, starts) / safe)
+
+    # Majority label along each contour, ignoring 'no color'
+    blob = np.repeat(np.arange(n), sizes)
+    colors = int(labels.max()) + 1
+    votes = np.bincount(blob * colors + labels[pts[:, 1], pts[:, 0]],
+            minlength=n * colors).reshape(n, colors)
+    votes[:, 0] = 0
+
+    det = np.zeros(n, DETECTION)
+    det["cx"], det["cy"], det["area"] = cx, cy, np.abs(area)
+    det["x"], det["y"] = np.minimum.reduceat(pts[:, 0], starts), np.minimum.reduceat(pts[:, 1], starts)
+    det["w"] = np.maximum.reduceat(pts[:, 0], starts) - det["x"] + 1
+    det["h"] = np.maximum.reduceat(pts[:, 1], starts) - det["y"] + 1
+    det["label"] = votes.argmax(axis=1)
+    hulls = np.empty(n, object)
+    for i, c in enumerate(cnts): hulls[i] = cv2.convexHull(c)
+    det["hull"] = hulls
+    return det
 
 class Camera:
     def __init__(self, drone, width, height, event):
@@ -30,6 +200,14 @@ class Camera:
         self.__capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
         self.__capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
 
+        # Grabber - backs off between BACKOFF_MIN and BACKOFF_MAX seconds
+        #  while the stream delivers nothing, decodes every skip'th grab
+        self.__BACKOFF_MIN, self.__BACKOFF_MAX = 0.005, 0.5
+        self.__skip = 1
+        self.__grabs, self.__skipped = 0, 0
+        self.__failed_grabs, self.__failed_reads = 0, 0
+        self.__backoff = 0.0
+
         # Configure computer vision
         print ">>> Configuring computer vision options..."
         self.__colors = False
@@ -38,9 +216,42 @@ class Camera:
                 ]
         self.__color_ranges = []
         self.__get_hsv()
+        self.__classifier = ColorClassifier(self.__color_ranges)
+
+        # Tracking - after a full scan only padded regions around the last
+        #  detections are searched, with a full rescan every RESCAN frames
+        #  or as soon as one of the regions loses its target
+        self.__tracking = False
+        self.__RESCAN, self.__PAD = 15, 20
+        self.__tracks = [] # (x, y, w, h) of the last detections
+        self.__since_scan = 0
+
+        # Analysis runs in a pool fed by the grabber, never on the Tk
+        #  thread. One worker keeps frames in order for tracking; a frame
+        #  is only submitted when the worker is idle (latest wins).
+        self.__pool = ThreadPoolExecutor(max_workers=1)
+        self.__pending = None
+        self.__result = None # (frame id, annotated RGB frame, detections)
+        self.__frame_id = 0  # increases with every frame the grabber decodes
+
+        # Frame delivery - one mailbox per consumer, getFrame uses the first.
+        #  Display consumers get previews no bigger than the requested size,
+        #  only analysis consumers that ask for them get full frames.
+        self.__preview_size = (width, height)
+        self.__mailboxes = []
+        self.__display = self.subscribe(preview=True)
+
+        # getFrame consumers by name, the frame id each saw last, and the
+        #  RGB conversions of the latest frame ids they share
+        self.__consumers = {"display": self.__display}
+        self.__returned = {}
+        self.__rgb_cache = deque(maxlen=4)
 
-        # Stored Frame
-        self.__currentFrame = None
+        # Analysis and display stages report into the drone's video metrics
+        self.__metrics = self.__drone.VideoMetrics
+        self.__grab_times = deque(maxlen=16) # (frame id, time it was grabbed)
+        self.__display_dropped = 0
+        self.__overlay = False
 
         # Done initializing
         print ">>> CAMERA READY"
@@ -48,69 +259,199 @@ class Camera:
     def __get_hsv(self):
         """Converts BGR values in constructor to min/max of HSV"""
         for color in self.__color_def:
-            # Colors defined as OpenCV-standard BGR values in constructor
-            hsv = cv2.cvtColor(color, cv2.COLOR_BGR2HSV)
-
-            # Ranges to accomodate changes in lighting around a 3d object
-            hue_low, hue_high = hsv[0][0][0] - 10, hsv[0][0][0] + 10
-
-            # Low for dark/shady lighting, high for light/bright
-            self.__color_ranges.append((
-                np.array([hue_low, 75, 75]),
-                np.array([hue_high, 255, 255])))
+            # Colors defined as OpenCV-standard BGR values in constructor,
+            #  ranges accomodate changes in lighting around a 3d object
+            self.__color_ranges.append(hsv_range(color[0][0]))
 
     def __make_colors(self, img):
         """Derives threshold image (black&white) using HSV values.
            Uses threshold image to isolate shapes of given HSVs.
-           Draws a contour around each shape on original image."""
-        # Declare mask var of correct shape to which new masks will be 'added'
-        mask_acc = np.zeros((img.shape[0], img.shape[1]), np.uint8)
+           Draws a contour around each shape on original image and
+           returns the DETECTION records of the shapes.
+           In tracking mode only the regions around the last
+           detections are searched between full scans."""
+        height, width = img.shape[:2]
+        if self.__tracking and self.__tracks and self.__since_scan < self.__RESCAN:
+            rois = self.__track_rois(width, height)
+            self.__since_scan += 1
+        else:
+            rois = [(0, 0, width, height)]
+            self.__since_scan = 0
+
+        cnts, lost = [], False
+        labels = np.zeros((height, width), np.uint8)
+        for x, y, w, h in rois:
+            found, labels[y:y + h, x:x + w] = self.__find_contours(
+                    img[y:y + h, x:x + w], (x, y))
+            lost = lost or not found
+            cnts.extend(found)
+        detections = describe_blobs(cnts, labels)
+        self.__tracks = zip(detections["x"], detections["y"],
+                detections["w"], detections["h"])
+        if lost: self.__since_scan = self.__RESCAN # Rescan on next frame
+
+        # Draw a border around every contour onto original image
+        if len(detections):
+            cv2.polylines(img, list(detections["hull"]), True, (255, 255, 255), 2)
+
+        # Return modified image and what was found on it
+        return img, detections
 
-        # Convert incoming image to HSV for comparison to calculated HSV ranges
+    def __find_contours(self, img, offset):
+        """Contours of all colored shapes in (a region of) a frame,
+           in frame coordinates, and its label image. Labels are
+           spread by the blur radius so contours lie on their color."""
+        # Classify all colors at once into a combined mask and label image
         img_hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-        for hsv_range in self.__color_ranges:
-            # Identify colors and add their pixel positions to mask accumulator
-            mask_cur = cv2.inRange(img_hsv, hsv_range[0], hsv_range[1])
-            mask_acc = cv2.add(mask_acc, mask_cur)
+        mask_acc, labels = self.__classifier.classify(img_hsv)
 
         # Identify contours of shapes in mask accumulator
         blurred = cv2.GaussianBlur(mask_acc, (5, 5), 0)
         thresh = cv2.threshold(blurred, 60, 255, cv2.THRESH_BINARY)[1]
-        cnts = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[1]
+        cnts = cv2.findContours(thresh, cv2.RETR_EXTERNAL,
+                cv2.CHAIN_APPROX_SIMPLE, offset=offset)[1]
+        return cnts, cv2.dilate(labels, np.ones((5, 5), np.uint8))
 
-        # Draw a border around every contour onto original image
-        for c in cnts:
-            hull = cv2.convexHull(c)
-            tar_range = len(hull)
-            for i in range(tar_range):
-                px, py = list(hull[i][0]), list(hull[(i + 1) % tar_range][0])
-                cv2.line(img, (px[0], px[1]), (py[0], py[1]), (255, 255, 255), 2)
-
-        # Return modified image
-        return img
+    def __track_rois(self, width, height):
+        """Padded boxes around the last detections, clipped to the
+           frame, with overlapping boxes merged so nothing is found twice."""
+        rois = []
+        for x, y, w, h in self.__tracks:
+            pad_x, pad_y = max(self.__PAD, w // 2), max(self.__PAD, h // 2)
+            rois.append([max(0, x - pad_x), max(0, y - pad_y),
+                    min(width, x + w + pad_x), min(height, y + h + pad_y)])
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(rois)):
+                for j in range(i + 1, len(rois)):
+                    a, b = rois[i], rois[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        rois[i] = [min(a[0], b[0]), min(a[1], b[1]),
+                                max(a[2], b[2]), max(a[3], b[3])]
+                        del rois[j]
+                        merged = True
+                        break
+                if merged: break
+        return [(x0, y0, x1 - x0, y1 - y0) for x0, y0, x1, y1 in rois]
 
     def __updateFrame(self):
         """Threaded function to continuously query drone for a new
-           frame of its camera sensor, and do a basic check of
-           presence to avoid errors propagating in GUI"""
+           frame of its camera sensor. grab() and retrieve() are split
+           so skipped frames are never converted, failed grabs back off
+           exponentially instead of spinning, and bad frames are
+           counted and dropped before they reach the GUI."""
         while(not self.__CAM_EVENT.is_set()):
-            ret, frame = self.__capture.read()
-            while not ret: ret, frame = self.__capture.read()
-            try: frame[:,:]  # some erroneous frame detection in
-            except: continue #  case a bad image gets through
-            self.__currentFrame = frame
-
-    def getFrame(self):
-        """Public function to retrieve the last good frame from the
+            if not self.__capture.grab():
+                # Stream stalled - sleep, but wake up at once on shutdown
+                self.__failed_grabs += 1
+                self.__backoff = min(self.__BACKOFF_MAX,
+                        max(self.__BACKOFF_MIN, self.__backoff * 2))
+                self.__CAM_EVENT.wait(self.__backoff)
+                continue
+            self.__backoff = 0.0
+            self.__grabs += 1
+            if self.__grabs % self.__skip:
+                self.__skipped += 1
+                continue
+            ret, frame = self.__capture.retrieve()
+            if not ret or frame is None or frame.ndim != 3 or not frame.size:
+                self.__failed_reads += 1
+                continue
+            self.__frame_id += 1
+            self.__grab_times.append((self.__frame_id, time.time()))
+            preview = self.__make_preview(frame)
+            for mailbox, is_preview in self.__mailboxes:
+                mailbox.put(preview if is_preview else frame, frame_id=self.__frame_id)
+            if self.__colors and (self.__pending is None or self.__pending.done()):
+                self.__pending = self.__pool.submit(self.__analyze, self.__frame_id, frame)
+                self.__pending.add_done_callback(self.__analyzed)
+            elif self.__colors: self.__metrics.drop("analysis")
+
+    def __analyze(self, frame_id, frame):
+        """Worker side of the analysis stage. Works on a copy of the
+           full frame, since it is shared with the other consumers, so
+           detections are in full frame pixels; only the annotated
+           image is scaled down for display."""
+        start = time.time()
+        out_image, detections = self.__make_colors(frame.copy())
+        out_image = self.__make_preview(out_image)
+        self.__metrics.record("analysis", time.time() - start)
+        return frame_id, cv2.cvtColor(out_image, cv2.COLOR_BGR2RGB), detections
+
+    def __analyzed(self, future):
+        """Publishes a finished analysis, runs in the worker."""
+        if future.exception() is not None:
+            print ">>> Frame analysis failed: {}".format(future.exception())
+        else: self.__result = future.result()
+
+    def __make_preview(self, img):
+        """Downscales HD frames to the preview size, keeping aspect."""
+        height, width = img.shape[:2]
+        scale = min(float(self.__preview_size[0]) / width,
+                float(self.__preview_size[1]) / height)
+        if scale >= 1.0: return img
+        return cv2.resize(img, (int(width * scale), int(height * scale)),
+                interpolation=cv2.INTER_AREA)
+
+    def subscribe(self, policy=FrameMailbox.LATEST, size=4, nth=1, preview=False):
+        """Returns a new mailbox that receives every captured frame
+           according to its policy, either full size or as preview.
+           Consumers added while running start with the next frame."""
+        mailbox = FrameMailbox(policy, size, nth)
+        self.__mailboxes.append((mailbox, preview))
+        return mailbox
+
+    def getFrame(self, consumer="display"):
+        """Public function to retrieve the newest frame from the
            threaded updateFrame function and perform any image
-           modification before returning it."""
-        out_image = self.__currentFrame
+           modification before returning it. Returns None if no new
+           frame arrived since this consumer's last call. With colors
+           on, this is the most recent frame the analysis pool has
+           finished. Outputs are shared between consumers by frame id,
+           so they must not be modified in place."""
+        if consumer not in self.__consumers:
+            self.__consumers[consumer] = self.subscribe(preview=True)
+        latest = self.__consumers[consumer].get()
 
         # Checking if color flag is toggled 'on'
-        if self.__colors: out_image = self.__make_colors(out_image)
+        if self.__colors:
+            result = self.__result
+            if result is None or result[0] == self.__returned.get(consumer): return None
+            frame_id, out_image = result[:2]
+        else:
+            if latest is None: return None
+            frame_id, out_image = latest[0], self.__rgb(*latest)
+        self.__returned[consumer] = frame_id
+        if consumer == "display": self.__displayed(frame_id)
 
         # Return image in requested form
-        return cv2.cvtColor(out_image, cv2.COLOR_BGR2RGB)
+        if self.__overlay: out_image = self.__metrics.overlay(out_image.copy())
+        return out_image
+
+    def __displayed(self, frame_id):
+        """Records the display stage: age of the frame since it was
+           grabbed, frames waiting and frames the display missed."""
+        age = None
+        for grabbed_id, grabbed in list(self.__grab_times):
+            if grabbed_id == frame_id: age = time.time() - grabbed
+        stats = self.__display.stats()
+        self.__metrics.record("display", age, stats["pending"])
+        self.__metrics.drop("display", stats["dropped"] - self.__display_dropped)
+        self.__display_dropped = stats["dropped"]
+
+    def __rgb(self, frame_id, frame):
+        """BGR to RGB conversion, done once per frame id."""
+        for cached_id, rgb in list(self.__rgb_cache):
+            if cached_id == frame_id: return rgb
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        self.__rgb_cache.append((frame_id, rgb))
+        return rgb
+
+    def get_analysis(self):
+        """Most recent finished analysis as (frame id, annotated RGB
+           preview, detections in full frame pixels), or None."""
+        return self.__result
 
     def start(self):
         """Begin the threaded frame update function"""
@@ -120,9 +461,38 @@ class Camera:
     def release(self):
         """Stops the video capture. Must be used before the drone
            is shut down."""
+        self.__pool.shutdown()
         return self.__capture.release()
 
+    def frame_stats(self):
+        """Produced/consumed/dropped counters of the display mailbox."""
+        return self.__display.stats()
+
+    def skip_grabs(self, n):
+        """Only decode every n'th frame of the stream, for consumers
+           that can't keep up. 1 decodes every frame."""
+        self.__skip = max(1, int(n))
+
+    def grab_stats(self):
+        """Counters of the grabber thread and its current backoff."""
+        return {"grabs": self.__grabs,
+                "skipped": self.__skipped,
+                "failed_grabs": self.__failed_grabs,
+                "failed_reads": self.__failed_reads,
+                "backoff": self.__backoff}
+
     def tog_colors(self):
         """Toggle highlighting contours of colors given in constructor."""
         self.__colors = not self.__colors
 
+    def tog_metrics(self):
+        """Toggle drawing the video metrics onto displayed frames."""
+        self.__overlay = not self.__overlay
+
+    def tog_tracking(self, rescan=None):
+        """Toggle searching only around the last detections, with a
+           full-frame rescan every 'rescan' frames."""
+        if rescan: self.__RESCAN = rescan
+        self.__tracking = not self.__tracking
+        self.__tracks, self.__since_scan = [], 0
+
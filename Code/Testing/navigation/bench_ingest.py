@@ -0,0 +1,62 @@
+import os, sys, time, random, threading
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "Production"))
+from navigator import Navigator
+
+# Replays full NavData at the drone's 200 Hz to a Navigator, both ways
+#  it may listen: polling NavDataCount or a NavData callback. Reports
+#  how many packages became samples and the CPU the Navigator costs.
+RATE     = 200.0
+DURATION = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+
+class ReplayDrone:
+    def __init__(self):
+        self.NavData, self.NavDataCount = {}, 0
+        self.callbacks = []
+        self.running = True
+        self.thread = threading.Thread(target=self.__send)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def useDemoMode(self, value): pass
+    def getNDpackage(self, packets): pass
+    def addNavDataCallback(self, function): self.callbacks = self.callbacks + [function]
+    def removeNavDataCallback(self, function): self.callbacks = [f for f in self.callbacks if f != function]
+
+    def __send(self):
+        r, begin = random.random, time.time()
+        while self.running:
+            self.NavData = {
+                    "raw_measures": [[r(), r(), r()], [r(), r(), r()]],
+                    "gps": [25.759 + r() * 1e-5, -80.374 + r() * 1e-5, 3.0],
+                    "demo": [[0, 0, 1, 0, 1], 0, [r(), r(), r()], 1500, [r(), r(), r()]],
+                    "magneto": [[r() * 10, r() * 10, 0], 0, 0, 0, 0, 0, r()],
+                    "altitude": [1500 + r() * 10]}
+            self.NavDataCount += 1
+            for callback in self.callbacks: callback(self.NavData, self.NavDataCount, time.time())
+            time.sleep(max(begin + self.NavDataCount / RATE - time.time(), 0))
+
+def measure(drone, navigator):
+    packets, samples = drone.NavDataCount, navigator._Navigator__samp_count
+    cpu, begin = sum(os.times()[:2]), time.time()
+    time.sleep(DURATION)
+    elapsed = time.time() - begin
+    return ((drone.NavDataCount - packets) / elapsed,
+            (navigator._Navigator__samp_count - samples) / elapsed,
+            100.0 * (sum(os.times()[:2]) - cpu) / elapsed)
+
+# The replay alone, then with a Navigator listening
+drone = ReplayDrone()
+time.sleep(1.0)
+rate, _, idle_cpu = measure(drone, type("Idle", (), {"_Navigator__samp_count": 0})())
+navigator = Navigator(drone)
+rate, samples, cpu = measure(drone, navigator)
+
+print "NavData packages  {:8.1f}/s".format(rate)
+print "Samples taken     {:8.1f}/s ({:.0f}%)".format(samples, 100.0 * samples / rate)
+print "Navigator CPU     {:8.1f}% of a core (replay alone {:.1f}%)".format(cpu - idle_cpu, idle_cpu)
+if hasattr(navigator, "stop"):
+    navigator.stop()
+    count = navigator._Navigator__samp_count
+    time.sleep(0.5)
+    print "After stop()      {} new samples".format(navigator._Navigator__samp_count - count)
+drone.running = False
@@ -0,0 +1,27 @@
+import os, sys, time
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", "Production"))
+import numpy as np
+import route
+
+# Orchard-like targets: a 5 m grid of trees with 0.5 m planting jitter,
+# a random subset of them to visit, start at the corner of the block
+SIZES  = [10, 50, 100, 500, 1000, 2000, 5000]
+BUDGET = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+rng = np.random.RandomState(3)
+
+def orchard(n):
+    side = int(np.ceil(np.sqrt(n * 3)))
+    rows, cols = np.divmod(rng.permutation(side * side)[:n], side)
+    return np.column_stack((cols * 5.0, rows * 5.0)) + rng.normal(0, 0.5, (n, 2))
+
+print "{:>6} {:>12} {:>12} {:>7} {:>9}".format("size", "NN (m)", "route (m)", "gain", "time (s)")
+for n in SIZES:
+    points, start = orchard(n), (-5.0, -5.0)
+    seed = route.optimize(points, start, time_budget=0.0)[1]
+    begin = time.time()
+    order, length = route.optimize(points, start, BUDGET)
+    spent = time.time() - begin
+    assert sorted(order) == range(n)
+    assert abs(route.length(points, start, order) - length) < 1e-6
+    print "{:>6} {:>12.0f} {:>12.0f} {:>6.1f}% {:>9.2f}".format(
+            n, seed, length, 100.0 * (seed - length) / seed, spent)
@@ -0,0 +1,42 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "Production"))
+import numpy as np
+import geo
+from estimator import StateEstimator
+
+# A drone hovering at a fixed spot, reporting at 200 Hz with a new GPS
+#  fix every 40 packets; packets without a fix must not poison the state
+HOME = (25.7590, -80.3745)
+NAN  = float("nan")
+
+def check(name, value, expected, tol):
+    ok = np.all(np.abs(np.asarray(value) - expected) <= tol)
+    print "{:<30} {}".format(name, "ok" if ok else "FAILED: {} != {}".format(value, expected))
+    return ok
+
+def hover(estimator, first, packets):
+    """Packets first.. at 200 Hz, the fix jitters a little every 40."""
+    for i in range(first, first + packets):
+        fix = [HOME[0] + (i // 40 % 2) * 1e-7, HOME[1]]
+        estimator.update(i / 200.0, fix, [0.0, 0.0, 0.0], 0.0, 0.0, 2.0)
+
+nan_first = StateEstimator()
+nan_first.update(0.0, [NAN, NAN], [0.0, 0.0, 0.0], 0.0, 0.0, 2.0)
+no_fix = nan_first.state()
+hover(nan_first, 1, 400)
+
+nan_later = StateEstimator()
+hover(nan_later, 0, 200)
+nan_later.update(1.0, [NAN, NAN], [0.0, 0.0, 0.0], 0.0, 0.0, 2.0)
+nan_later.update(1.005, [HOME[0], NAN], [0.0, 0.0, 0.0], 0.0, 0.0, 2.0)
+hover(nan_later, 202, 200)
+
+results = [
+    check("no state from a NaN fix", no_fix is None, 1, 0),
+    check("NaN first, then fixes", nan_first.state()["gps"], HOME, 1e-6),
+    check("NaN between fixes", nan_later.state()["gps"], HOME, 1e-6),
+    check("position stays finite", np.isfinite(nan_later.state()["pos"]).all(), 1, 0),
+    ]
+
+print "{} of {} checks passed".format(sum(results), len(results))
+sys.exit(0 if all(results) else 1)
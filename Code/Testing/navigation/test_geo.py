@@ -0,0 +1,55 @@
+import os, sys, math
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", "Production"))
+import numpy as np
+import geo
+
+# Reference values on the 6371 km sphere (movable-type.co.uk/scripts/latlong.html)
+def dms(d, m, s): return math.copysign(abs(d) + m / 60.0 + s / 3600.0, d)
+
+LANDS_END    = (dms(50, 3, 59), -dms(5, 42, 53))
+JOHN_O_GROAT = (dms(58, 38, 38), -dms(3, 4, 12))
+QUARTER      = math.pi / 2 * geo.R_EARTH # equator to pole
+ONE_DEGREE   = math.radians(1) * geo.R_EARTH
+
+def local_distances():
+    # 500 m legs in all directions, 400 m away from the origin
+    enu = geo.LocalProjection(25.7590, -80.3745)
+    brng = np.arange(0, 360, 15)
+    lat, lon = geo.destination(25.7620, -80.3710, brng, 500.0)
+    e0, n0 = enu.to_local(25.7620, -80.3710)
+    e, n = enu.to_local(lat, lon)
+    return np.hypot(e - e0, n - n0)
+
+def check(name, value, expected, tol):
+    ok = np.all(np.abs(np.asarray(value) - expected) <= tol)
+    print "{:<30} {}".format(name, "ok" if ok else "FAILED: {} != {}".format(value, expected))
+    return ok
+
+results = [
+    check("haversine reference", geo.haversine(*(LANDS_END + JOHN_O_GROAT)), 968.9e3, 100),
+    check("haversine meridian degree", geo.haversine(10, 20, 11, 20), ONE_DEGREE, 1e-6),
+    check("haversine equator to pole", geo.haversine(0, 0, 90, 0), QUARTER, 1e-6),
+    check("haversine same point", geo.haversine(25.76, -80.37, 25.76, -80.37), 0.0, 1e-9),
+    check("bearing reference", geo.bearing(*(LANDS_END + JOHN_O_GROAT)), dms(9, 7, 11), 1e-3),
+    check("bearing east/west/north/south",
+            geo.bearing(0, 0, [0, 0, 10, -10], [10, -10, 0, 0]), [90, 270, 0, 180], 1e-9),
+    check("destination reference",
+            geo.destination(dms(53, 19, 14), -dms(1, 43, 47), dms(96, 1, 18), 124.8e3),
+            [dms(53, 11, 18), dms(0, 8, 0)], 2e-4),
+    check("destination round trip",
+            geo.haversine(25.76, -80.37, *geo.destination(25.76, -80.37, 33.0, 250.0)), 250.0, 1e-6),
+    check("cross-track left/right",
+            geo.cross_track([1, -1], [5, 5], 0, 0, 0, 10), [-ONE_DEGREE, ONE_DEGREE], 1e-6),
+    check("cross-track on path", geo.cross_track(0, 5, 0, 0, 0, 10), 0.0, 1e-6),
+    check("distance matrix",
+            geo.distance_matrix([0, 0, 90], [0, 90, 0]),
+            [[0, QUARTER, QUARTER], [QUARTER, 0, QUARTER], [QUARTER, QUARTER, 0]], 1e-6),
+    check("local projection", local_distances(), 500.0, 0.02),
+    check("local projection round trip",
+            geo.LocalProjection(25.76, -80.37).to_gps(
+                *geo.LocalProjection(25.76, -80.37).to_local(25.761, -80.372)),
+            [25.761, -80.372], 1e-12),
+    ]
+
+print "{} of {} checks passed".format(sum(results), len(results))
+sys.exit(0 if all(results) else 1)
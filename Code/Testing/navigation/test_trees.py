@@ -0,0 +1,89 @@
+import os, sys, json, shutil, tempfile, time
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", "Production"))
+import numpy as np
+import geo, trees
+
+# An orchard block of 200 x 150 trees, 6 m apart with 0.5 m planting
+#  jitter, a few missing; queries all over it and a little beyond
+QUERIES = 2000
+RATE    = 200 # Queries a second each kind must sustain
+rng = np.random.RandomState(7)
+enu = geo.LocalProjection(25.7590, -80.3745)
+col, row = np.meshgrid(np.arange(200), np.arange(150))
+xy = np.column_stack((col.ravel() * 6.0, row.ravel() * 6.0)) + rng.normal(0, 0.5, (30000, 2))
+xy = xy[rng.rand(len(xy)) > 0.02]
+lat, lon = enu.to_gps(xy[:, 0], xy[:, 1])
+ids = np.array(["T{:05d}".format(i) for i in range(len(xy))])
+q_xy = rng.uniform(-50, 1250, (QUERIES, 2))
+q_lat, q_lon = enu.to_gps(q_xy[:, 0], q_xy[:, 1])
+
+def check(name, ok):
+    print "{:<30} {}".format(name, "ok" if ok else "FAILED")
+    return ok
+
+def timed(name, query, args):
+    begin = time.time()
+    for a in args: query(*a)
+    rate = len(args) / (time.time() - begin)
+    return check("{} {:.0f}/s".format(name, rate), rate >= RATE)
+
+# Write both file formats and read them back
+folder = tempfile.mkdtemp()
+try:
+    with open(os.path.join(folder, "trees.csv"), "w") as f:
+        f.write("Tree_ID,Latitude,Longitude\n")
+        for i in range(len(ids)): f.write("{},{!r},{!r}\n".format(ids[i], lat[i], lon[i]))
+    with open(os.path.join(folder, "trees.geojson"), "w") as f:
+        json.dump({"type": "FeatureCollection", "features": [{"type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [lon[i], lat[i]]},
+                "properties": {"id": ids[i]}} for i in range(len(ids))]}, f)
+    from_csv = trees.load(os.path.join(folder, "trees.csv"), enu)
+    from_json = trees.load(os.path.join(folder, "trees.geojson"), enu)
+finally: shutil.rmtree(folder)
+
+results = [
+    check("load csv", len(from_csv) == len(ids) and list(from_csv.ids) == list(ids)),
+    check("load geojson", len(from_json) == len(ids) and list(from_json.ids) == list(ids)),
+    ]
+reg = from_csv
+
+# Compare against a scan of every tree
+ok = True
+for i in range(0, QUERIES, 10):
+    d = geo.haversine(q_lat[i], q_lon[i], lat, lon)
+    tree, dist = reg.nearest(q_lat[i], q_lon[i])
+    ok &= tree == ids[np.argmin(d)] and abs(dist - d.min()) < 0.01
+results.append(check("nearest", ok))
+
+ok = True
+for i in range(0, QUERIES, 10):
+    d = geo.haversine(q_lat[i], q_lon[i], lat, lon)
+    found, dist = reg.within(q_lat[i], q_lon[i], 15.0)
+    inner, outer = set(ids[d <= 15.0 - 0.01]), set(ids[d <= 15.0 + 0.01])
+    ok &= inner <= set(found) <= outer and np.all(np.diff(dist) >= 0)
+results.append(check("within", ok))
+
+poly_xy = np.array([[100, 100], [700, 150], [400, 400], [600, 800], [150, 500]], float)
+poly = np.column_stack(enu.to_gps(poly_xy[:, 0], poly_xy[:, 1]))
+path = np.vstack((poly_xy, poly_xy[:1]))
+inside = np.zeros(len(xy), bool)
+for (x1, y1), (x2, y2) in zip(path[:-1], path[1:]):
+    span = (y1 > xy[:, 1]) != (y2 > xy[:, 1])
+    inside ^= span & (xy[:, 0] < x1 + (xy[:, 1] - y1) * (x2 - x1) / (y2 - y1))
+results.append(check("in polygon", list(reg.in_polygon(poly)) == list(ids[inside])))
+
+# Without a GPS fix positions are NaN: no answer instead of an error
+nan = float("nan")
+results.append(check("no fix", reg.nearest(nan, nan) is None and reg.within(nan, lon[0], 10.0) is None
+        and reg.in_polygon([[lat[0], lon[0]], [nan, nan], [lat[1], lon[1]]]) is None))
+
+# Query rates
+results += [
+    timed("nearest rate", reg.nearest, zip(q_lat, q_lon)),
+    timed("within 10 m rate", reg.within, [(a, b, 10.0) for a, b in zip(q_lat, q_lon)]),
+    timed("in 30 m square rate", reg.in_polygon, [([[a, b], [a + 3e-4, b], [a + 3e-4, b + 3e-4],
+            [a, b + 3e-4]],) for a, b in zip(q_lat[:500], q_lon[:500])]),
+    ]
+
+print "{} of {} checks passed".format(sum(results), len(results))
+sys.exit(0 if all(results) else 1)
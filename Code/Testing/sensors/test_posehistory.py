@@ -0,0 +1,43 @@
+import os, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "Production"))
+import ps_drone
+
+# The drone flies a steady yaw turn of 90 deg/s. NavData arrives every 5 ms,
+#  images every 33 ms, both 30 ms after they were taken. Frames then need a
+#  constant 80 ms to decode, which must not make their poses 80 ms late
+#  (7.2 deg of yaw).
+LATENCY, DECODE, RATE = 0.030, 0.080, 90.0
+start = time.time() - 5.0
+history = ps_drone.PoseHistory()
+for i in range(1000):
+    taken = i * 0.005
+    yaw = (RATE * taken + 180.0) % 360.0 - 180.0
+    history.add(start + taken + LATENCY, {"demo": [0, 0, [0.0, 0.0, yaw], 1000]})
+
+def check(name, value, expected, tol):
+    ok = abs(value - expected) <= tol
+    print "{:<30} {}".format(name, "ok" if ok else "FAILED: {} != {}".format(value, expected))
+    return ok
+
+def frame_errors(anchor):
+    # Local time of each frame minus the moment it was taken, with the
+    #  offset anchored where it arrived or where it was decoded
+    history = ps_drone.PoseHistory()
+    errors = []
+    for n in range(10, 100):
+        taken = n * 0.033
+        received = start + taken + LATENCY
+        stamp = history.frameTime(int(taken * 1000), received + anchor)
+        errors.append(stamp - (start + taken))
+    return max(errors)
+
+results = [
+    check("offset ignores decode delay", frame_errors(0.0), LATENCY, 0.002),
+    check("decode-time anchor is late", frame_errors(DECODE), LATENCY + DECODE, 0.002),
+    ]
+pose = history.pose(history.frameTime(int(3.0 * 1000), start + 3.0 + LATENCY))
+results.append(check("pose of the moment taken", pose["pry"][2],
+        (RATE * 3.0 + 180.0) % 360.0 - 180.0, 0.5))
+
+print "{} of {} checks passed".format(sum(results), len(results))
+sys.exit(0 if all(results) else 1)
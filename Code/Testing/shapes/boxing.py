@@ -1,20 +1,30 @@
-import cv2
+import os, sys, cv2
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "Production"))
 import numpy as np
+from viewer import hsv_range, hue_intervals
 
 def get_hsv(colors, ranges):
+    # Same ranges as the camera's, hue bounds may reach below 0 for reds
     for color in colors:
-        hsv = cv2.cvtColor(color, cv2.COLOR_BGR2HSV)
-        hue_low, hue_high = hsv[0][0][0] - 10, hsv[0][0][0] + 10
-        ranges.append((
-            np.array([hue_low, 75, 75]),
-            np.array([hue_high, 255, 255])))
-
-def make_colors(img, color_mask, ranges):
-    mask_acc = color_mask.copy()
+        ranges.append(hsv_range(color[0][0]))
+
+def make_lut(ranges):
+    # One bitmask table per HSV channel, bit i set where range i matches
+    lut = np.zeros((3, 256), np.uint16)
+    for i, (low, high) in enumerate(ranges):
+        for hue_lo, hue_hi in hue_intervals(int(low[0]), int(high[0])):
+            lut[0, hue_lo:hue_hi + 1] |= 1 << i
+        lut[1, max(0, int(low[1])):int(high[1]) + 1] |= 1 << i
+        lut[2, max(0, int(low[2])):int(high[2]) + 1] |= 1 << i
+    return lut
+
+def make_colors(img, color_mask, lut):
     img_hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-    for hsv_range in ranges:
-        mask_cur = cv2.inRange(img_hsv, hsv_range[0], hsv_range[1])
-        mask_acc = cv2.add(mask_acc, mask_cur)
+    bits = np.take(lut[0], img_hsv[:, :, 0])
+    bits &= np.take(lut[1], img_hsv[:, :, 1])
+    bits &= np.take(lut[2], img_hsv[:, :, 2])
+    mask_acc = color_mask.copy()
+    mask_acc[bits > 0] = 255
     #out_img = cv2.bitwise_and(img, img, mask = mask_acc)
     return mask_acc
 
@@ -71,7 +81,7 @@ color_ranges = []
 get_hsv(color_def, color_ranges)
 
 mask = np.zeros((img.shape[0], img.shape[1]), np.uint8)
-mask = make_colors(img, mask, color_ranges)
+mask = make_colors(img, mask, make_lut(color_ranges))
 
 out_img = make_shapes(img, mask)
 
@@ -1,4 +1,5 @@
 import imutils, cv2
+import numpy as np
 
 img_string = "shapes_and_colors.jpg"
 
@@ -9,15 +10,31 @@ thresh = cv2.threshold(blurred, 60, 255, cv2.THRESH_BINARY)[1]
 
 cnts = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[1]
 
-for c in cnts[1:]:
-    M = cv2.moments(c)
-    cX = int(M["m10"] / M["m00"])
-    cY = int(M["m01"] / M["m00"])
+def centers(cnts):
+    # Polygon moments m00/m10/m01 of all contours at once (shoelace sums),
+    #  None when there is no target
+    if not len(cnts): return None
+    sizes = np.array([len(c) for c in cnts])
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    pts = np.concatenate(cnts).reshape(-1, 2).astype(np.float64)
+    nxt = np.arange(len(pts)) + 1
+    nxt[starts + sizes - 1] = starts
+    x, y = pts[:, 0], pts[:, 1]
+    cross = x * y[nxt] - x[nxt] * y
+    m00 = np.add.reduceat(cross, starts) / 2.0
+    cX = np.add.reduceat((x + x[nxt]) * cross, starts) / (6.0 * m00)
+    cY = np.add.reduceat((y + y[nxt]) * cross, starts) / (6.0 * m00)
+    return np.abs(m00), cX.astype(int), cY.astype(int)
 
-    cv2.drawContours(image, [c], -1, (0, 255, 0), 2)
-    cv2.circle(image, (cX, cY), 7, (255, 255, 255), -1)
-    cv2.putText(image, "center", (cX - 20, cY - 20),
-            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
+cv2.drawContours(image, cnts[1:], -1, (0, 255, 0), 2)
+found = centers(cnts[1:])
+if found is None: print "No target"
+else:
+    areas, cXs, cYs = found
+    for cX, cY in zip(cXs, cYs):
+        cv2.circle(image, (cX, cY), 7, (255, 255, 255), -1)
+        cv2.putText(image, "center", (cX - 20, cY - 20),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
 
 cv2.imshow("test", image)
 cv2.waitKey(0)
@@ -0,0 +1,30 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "Production"))
+import numpy as np
+from viewer import ColorClassifier, hue_intervals
+
+# A red target near hue 0: its +-10 range must wrap to 170-179 and
+#  0-12 instead of underflowing into an empty 248-12 range
+def check(name, value, expected):
+    ok = value == expected
+    print "{:<30} {}".format(name, "ok" if ok else "FAILED ({} != {})".format(value, expected))
+    return ok
+
+def labels(classifier, hues):
+    hsv = np.zeros((1, len(hues), 3), np.uint8)
+    hsv[0, :, 0], hsv[0, :, 1:] = hues, 200
+    return list(classifier.classify(hsv)[1][0])
+
+red = ColorClassifier([(np.array([2 - 10, 75, 75]), np.array([2 + 10, 255, 255]))])
+wrapped = ColorClassifier([(np.array([172, 75, 75]), np.array([12, 255, 255]))])
+hues = [0, 2, 12, 13, 169, 170, 179, 90]
+results = [
+    check("intervals of -8..12", hue_intervals(-8, 12), [(172, 179), (0, 12)]),
+    check("intervals of 170..190", hue_intervals(170, 190), [(170, 179), (0, 10)]),
+    check("intervals of 60..80", hue_intervals(60, 80), [(60, 80)]),
+    check("red near hue 0", labels(red, hues), [1, 1, 1, 0, 0, 0, 1, 0]),
+    check("red given low > high", labels(wrapped, hues), [1, 1, 1, 0, 0, 0, 1, 0]),
+    ]
+
+print "{} of {} checks passed".format(sum(results), len(results))
+sys.exit(0 if all(results) else 1)
@@ -0,0 +1,74 @@
+"""Great-circle geodesy on a spherical earth, vectorized with NumPy.
+
+   Coordinates are in degrees, distances in meters, bearings in degrees
+   clockwise from North (0-360). Every function takes scalars or arrays
+   and broadcasts them against each other, so one call can compare a
+   position with thousands of trees, or all trees with each other."""
+import numpy as np
+
+R_EARTH = 6371e3 # mean earth radius in m
+
+def is_fix(lat, lon):
+    """Whether (lat, lon) is a real GPS fix: finite, and not the (0, 0)
+       the drone reports before it has one."""
+    return bool(np.isfinite(lat) and np.isfinite(lon) and (lat, lon) != (0.0, 0.0))
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance between points 1 and 2."""
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dphi = phi2 - phi1
+    dlam = np.radians(np.subtract(lon2, lon1))
+    a = np.sin(dphi / 2)**2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlam / 2)**2
+    return 2 * R_EARTH * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+def bearing(lat1, lon1, lat2, lon2):
+    """Initial bearing of the great circle from point 1 to point 2."""
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dlam = np.radians(np.subtract(lon2, lon1))
+    q = np.sin(dlam) * np.cos(phi2)
+    p = np.cos(phi1) * np.sin(phi2) - np.sin(phi1) * np.cos(phi2) * np.cos(dlam)
+    return (np.degrees(np.arctan2(q, p)) + 360.0) % 360.0
+
+def destination(lat, lon, brng, dist):
+    """Point reached from (lat, lon) after dist along the great circle
+       of initial bearing brng. Returns (lat, lon)."""
+    phi1, lam1 = np.radians(lat), np.radians(lon)
+    theta, delta = np.radians(brng), np.divide(dist, R_EARTH)
+    phi2 = np.arcsin(np.sin(phi1) * np.cos(delta) +
+            np.cos(phi1) * np.sin(delta) * np.cos(theta))
+    lam2 = lam1 + np.arctan2(np.sin(theta) * np.sin(delta) * np.cos(phi1),
+            np.cos(delta) - np.sin(phi1) * np.sin(phi2))
+    return np.degrees(phi2), (np.degrees(lam2) + 540.0) % 360.0 - 180.0
+
+def cross_track(lat, lon, lat1, lon1, lat2, lon2):
+    """Distance of (lat, lon) from the great circle through points 1
+       and 2, positive to the right of the path from 1 to 2."""
+    delta13 = haversine(lat1, lon1, lat, lon) / R_EARTH
+    theta13 = np.radians(bearing(lat1, lon1, lat, lon))
+    theta12 = np.radians(bearing(lat1, lon1, lat2, lon2))
+    return np.arcsin(np.sin(delta13) * np.sin(theta13 - theta12)) * R_EARTH
+
+class LocalProjection:
+    """Flat east/north meters around an origin, for orchard-sized
+       areas (distances within about 1 cm over 500 m). The meters per
+       degree are computed once, so projecting is a multiply-add."""
+
+    def __init__(self, lat0, lon0):
+        self.origin = (lat0, lon0)
+        self.__m_lat = np.radians(1.0) * R_EARTH
+        self.__m_lon = self.__m_lat * np.cos(np.radians(lat0))
+
+    def to_local(self, lat, lon):
+        """(east, north) of GPS coordinates."""
+        return (np.subtract(lon, self.origin[1]) * self.__m_lon,
+                np.subtract(lat, self.origin[0]) * self.__m_lat)
+
+    def to_gps(self, east, north):
+        """(lat, lon) of local coordinates."""
+        return (self.origin[0] + np.divide(north, self.__m_lat),
+                self.origin[1] + np.divide(east, self.__m_lon))
+
+def distance_matrix(lats, lons):
+    """Distances between all pairs of the given points."""
+    lats, lons = np.asarray(lats, float), np.asarray(lons, float)
+    return haversine(lats[:, None], lons[:, None], lats[None, :], lons[None, :])
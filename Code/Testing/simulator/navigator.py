@@ -1,4 +1,4 @@
-import itertools, ps_sim, time, math
+import coverage, geo, itertools, ps_sim, route, time, math
 from threading import Thread
 from collections import deque
 import numpy as np
@@ -16,6 +16,9 @@ class Navigator:
         self.__SOFT_TURN = 0.1
         self.__HARD_TURN = 0.3
         self.__DEF_SPD   = 0.3
+        self.__CAM_FOV   = 64.0 # Camera field of view across a survey pass, degrees
+        self.__OVERLAP   = 0.3  # Share of an image seen again from the next pass
+        self.__MIN_ALT   = 2.0  # Altitude assumed for pass spacing when lower, m
         self.__SAMP_NUM  = 150
         self.__SAMP_TIME = 0.005
 
@@ -154,17 +157,22 @@ class Navigator:
             self.__set_stats()
             start = list(self.__stats["gps"])
         else: start = self.__tar_gps
-        temp_start = start
-
-        # Use NN to find shortest paths, queue targets as they're found
-        while self.__targets:
-            shortest = 1.0e999 # infinity
-            for tar in self.__targets:
-                dist = self.__calc_distance(temp_start, tar)
-                if dist < shortest: shortest, start = dist, tar
-            self.waypoints.append(start)
-            self.__targets.remove(start)
-            temp_start = start
+
+        # Queue the targets in the order of a short route
+        for tar in self.plan_route(self.__targets, start):
+            self.waypoints.append(tar)
+        self.__targets = []
+
+    def plan_route(self, targets, start, time_budget=None):
+        """Orders targets (each [lat, lon]) into a short route from
+           start, see route.optimize. Returns the targets in order."""
+        if not targets: return []
+        enu = geo.LocalProjection(start[0], start[1])
+        tars = np.array(targets, float)
+        east, north = enu.to_local(tars[:, 0], tars[:, 1])
+        order, length = route.optimize(np.column_stack((east, north)),
+                (0.0, 0.0), time_budget)
+        return [targets[i] for i in order]
 
     def next_tar(self):
         """Pop the next coordinate from the queue to current target"""
@@ -177,31 +185,11 @@ class Navigator:
 
     def __calc_distance(self, start, finish):
         """Calculate distance to target"""
-        r = 6371e3  # earth's radius in m
-        x, y = start, finish
-
-        # Convert GPS degrees to radians
-        phi1 = math.radians(x[0])
-        phi2 = math.radians(y[0])
-        dphi = math.radians(y[0] - x[0])
-        dlam = math.radians(y[1] - x[1])
-
-        # 'Great circle' distance between two GPS coords
-        a = math.sin(dphi / 2) * math.sin(dphi / 2)
-        a += math.cos(phi1) * math.cos(phi2)
-        a *= (math.sin(dlam / 2) * math.sin(dlam / 2))
-        return 2 * r * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+        return geo.haversine(start[0], start[1], finish[0], finish[1])
 
     def __calc_heading(self, start, finish):
         """Calculate necessary heading for straight flight to target"""
-        x, y = start, finish
-
-        # Initial heading required for 'Great circle' traversal
-        q = math.sin(y[1] - x[1]) * math.cos(y[0])
-        p = math.cos(x[0]) * math.sin(y[0])
-        p -= math.sin(x[0]) * math.cos(y[0]) * math.cos(y[1] - x[1])
-        b = math.atan2(q, p) * 180.0 / math.pi
-        return (b + 360.0) % 360.0
+        return geo.bearing(start[0], start[1], finish[0], finish[1])
 
     def __calc_mag(self):
         """Rotates the drone to acquire mag data to use in normalization."""
@@ -325,159 +313,26 @@ class Navigator:
         if old_target != None:
             self.mod_waypoints([old_target])
 
-    def gen_waypnts(self,gps_coors):
-        if(len(gps_coors) != 0):
-            self.range = 6
-            # GPS path coordinates
-            self.gen_waypnts_arr = []
-
-            self.rec_vrts_1 = gps_coors[0]
-            self.rec_vrts_2 = gps_coors[1]
-            self.rec_vrts_3 = gps_coors[2]
-            self.rec_vrts_4 = gps_coors[3]
-
-            # East to West path orientation
-            if(abs(self.rec_vrts_1[1] - self.rec_vrts_3[1]) > abs(self.rec_vrts_1[0]-self.rec_vrts_3[0])
-                                    and self.rec_vrts_1[1] > self.rec_vrts_3[1]):
-                # Generate test waypoints longitudinally
-                self.max_vrtcs_lon = abs(self.rec_vrts_1[1] - self.rec_vrts_3[1])/self.range
-                self.temp_lon = self.rec_vrts_1[1]
-                self.temp_lat = self.rec_vrts_1[0]
-
-                self.gen_waypnts_arr.append([self.temp_lat,self.temp_lon])
-                for vrtx in range(self.range):
-                    #start vertex -> shortest length -> longest length -> shortest length etc.
-                    self.new_tempvrtx = self.temp_lon - self.max_vrtcs_lon
-                    if(vrtx % 2 == 0 and vrtx < self.range - 1):
-                        self.gen_waypnts_arr.append([self.temp_lat, self.new_tempvrtx])
-                        self.temp_lat = self.rec_vrts_3[0]
-                        self.gen_waypnts_arr.append([self.temp_lat, self.new_tempvrtx])
-                        self.temp_lon = self.new_tempvrtx
-                        self.new_tempvrtx = 0
-                    elif(vrtx % 2 == 1 and vrtx < self.range -1):
-                        self.gen_waypnts_arr.append([self.temp_lat,self.new_tempvrtx])
-                        self.temp_lat = self.rec_vrts_1[0]
-                        self.gen_waypnts_arr.append([self.temp_lat, self.new_tempvrtx])
-                        self.temp_lon = self.new_tempvrtx
-                        self.new_tempvrtx = 0
-                    elif(vrtx % 2 == 1 and vrtx == self.range-1):
-                        self.gen_waypnts_arr.append([self.temp_lat, self.new_tempvrtx])
-                        self.temp_lat = self.rec_vrts_3[0]
-                        self.gen_waypnts_arr.append([self.temp_lat, self.rec_vrts_3[1]])
-                        self.new_tempvrtx = 0
-                        break
-                    elif(vrtx % 2 == 0 and vrtx == self.range-1):
-                        self.gen_waypnts_arr.append([self.temp_lat, self.new_tempvrtx])
-                        self.temp_lat = self.rec_vrts_2[0]
-                        self.gen_waypnts_arr.append([self.temp_lat, self.rec_vrts_2[1]])
-                        self.new_tempvrtx = 0
-                        break
-            #West to East path orientation
-            elif(abs(self.rec_vrts_1[1] - self.rec_vrts_3[1]) > abs(self.rec_vrts_1[0]-self.rec_vrts_3[0])
-                                    and self.rec_vrts_1[1] < self.rec_vrts_3[1]):
-                # Generate test waypoints longitudinally
-                self.max_vrtcs_lon = abs(self.rec_vrts_1[1] - self.rec_vrts_3[1])/self.range
-                self.temp_lon = self.rec_vrts_1[1]
-                self.temp_lat = self.rec_vrts_1[0]
-
-                self.gen_waypnts_arr.append([self.temp_lat,self.temp_lon])
-                for vrtx in range(self.range):
-                    #start vertex -> shortest length -> longest length -> shortest length etc.
-                    self.new_tempvrtx = self.temp_lon + self.max_vrtcs_lon
-                    if(vrtx % 2 == 0 and vrtx < self.range - 1):
-                        self.gen_waypnts_arr.append([self.temp_lat, self.new_tempvrtx])
-                        self.temp_lat = self.rec_vrts_3[0]
-                        self.gen_waypnts_arr.append([self.temp_lat, self.new_tempvrtx])
-                        self.temp_lon = self.new_tempvrtx
-                        self.new_tempvrtx = 0
-                    elif(vrtx % 2 == 1 and vrtx < self.range -1):
-                        self.gen_waypnts_arr.append([self.temp_lat,self.new_tempvrtx])
-                        self.temp_lat = self.rec_vrts_1[0]
-                        self.gen_waypnts_arr.append([self.temp_lat, self.new_tempvrtx])
-                        self.temp_lon = self.new_tempvrtx
-                        self.new_tempvrtx = 0
-                    elif(vrtx % 2 == 1 and vrtx == self.range-1):
-                        self.gen_waypnts_arr.append([self.temp_lat, self.new_tempvrtx])
-                        self.temp_lat = self.rec_vrts_3[0]
-                        self.gen_waypnts_arr.append([self.temp_lat, self.rec_vrts_3[1]])
-                        self.new_tempvrtx = 0
-                        break
-                    elif(vrtx % 2 == 0 and vrtx == self.range-1):
-                        self.gen_waypnts_arr.append([self.temp_lat, self.new_tempvrtx])
-                        self.temp_lat = self.rec_vrts_2[0]
-                        self.gen_waypnts_arr.append([self.temp_lat, self.rec_vrts_2[1]])
-                        self.new_tempvrtx = 0
-                        break
-            # South to North path orientation
-            elif(abs(self.rec_vrts_1[1] - self.rec_vrts_3[1]) < abs(self.rec_vrts_1[0]-self.rec_vrts_3[0])
-                                    and self.rec_vrts_1[0] > self.rec_vrts_3[0]):
-                # Generate test waypoints longitudinally
-                self.max_vrtcs_lat = abs(self.rec_vrts_1[0] - self.rec_vrts_3[0])/self.range
-                self.temp_lon = self.rec_vrts_1[1]
-                self.temp_lat = self.rec_vrts_1[0]
-
-                self.gen_waypnts_arr.append([self.temp_lat,self.temp_lon])
-                for vrtx in range(self.range):
-                    #start vertex -> shortest length -> longest length -> shortest length etc.
-                    self.new_tempvrtx = self.temp_lat - self.max_vrtcs_lat
-                    if(vrtx % 2 == 0 and vrtx < self.range - 1):
-                        self.gen_waypnts_arr.append([self.new_tempvrtx, self.temp_lon])
-                        self.temp_lon = self.rec_vrts_3[1]
-                        self.gen_waypnts_arr.append([self.new_tempvrtx, self.temp_lon])
-                        self.temp_lat = self.new_tempvrtx
-                        self.new_tempvrtx = 0
-                    elif(vrtx % 2 == 1 and vrtx < self.range -1):
-                        self.gen_waypnts_arr.append([self.new_tempvrtx,self.temp_lon])
-                        self.temp_lon = self.rec_vrts_1[1]
-                        self.gen_waypnts_arr.append([self.new_tempvrtx, self.temp_lon])
-                        self.temp_lat = self.new_tempvrtx
-                        self.new_tempvrtx = 0
-                    elif(vrtx % 2 == 1 and vrtx == self.range-1):
-                        self.gen_waypnts_arr.append([self.new_tempvrtx, self.temp_lon])
-                        self.temp_lon = self.rec_vrts_3[1]
-                        self.gen_waypnts_arr.append([self.rec_vrts_3[0], self.temp_lon])
-                        self.new_tempvrtx = 0
-                        break
-                    elif(vrtx % 2 == 0 and vrtx == self.range-1):
-                        self.gen_waypnts_arr.append([self.rec_vrts_3[0], self.temp_lon])
-                        self.new_tempvrtx = 0
-                        break
-            # North to South path orientation
-            elif(abs(self.rec_vrts_1[1] - self.rec_vrts_3[1]) < abs(self.rec_vrts_1[0]-self.rec_vrts_3[0])
-                                    and self.rec_vrts_1[0] < self.rec_vrts_3[0]):
-                # Generate test waypoints longitudinally
-                self.max_vrtcs_lat = abs(self.rec_vrts_1[0] - self.rec_vrts_3[0])/self.range
-                self.temp_lon = self.rec_vrts_1[1]
-                self.temp_lat = self.rec_vrts_1[0]
-
-                self.gen_waypnts_arr.append([self.temp_lat,self.temp_lon])
-                for vrtx in range(self.range):
-                    #start vertex -> shortest length -> longest length -> shortest length etc.
-                    self.new_tempvrtx = self.temp_lat + self.max_vrtcs_lat
-                    if(vrtx % 2 == 0 and vrtx < self.range - 1):
-                        self.gen_waypnts_arr.append([self.new_tempvrtx, self.temp_lon])
-                        self.temp_lon = self.rec_vrts_3[1]
-                        self.gen_waypnts_arr.append([self.new_tempvrtx, self.temp_lon])
-                        self.temp_lat = self.new_tempvrtx
-                        self.new_tempvrtx = 0
-                    elif(vrtx % 2 == 1 and vrtx < self.range -1):
-                        self.gen_waypnts_arr.append([self.new_tempvrtx,self.temp_lon])
-                        self.temp_lon = self.rec_vrts_1[1]
-                        self.gen_waypnts_arr.append([self.new_tempvrtx, self.temp_lon])
-                        self.temp_lat = self.new_tempvrtx
-                        self.new_tempvrtx = 0
-                    elif(vrtx % 2 == 1 and vrtx == self.range-1):
-                        self.gen_waypnts_arr.append([self.new_tempvrtx, self.temp_lon])
-                        self.temp_lon = self.rec_vrts_3[1]
-                        self.gen_waypnts_arr.append([self.rec_vrts_3[0], self.temp_lon])
-                        self.new_tempvrtx = 0
-                        break
-                    elif(vrtx % 2 == 0 and vrtx == self.range-1):
-                        self.gen_waypnts_arr.append([self.rec_vrts_3[0], self.temp_lon])
-                        self.new_tempvrtx = 0
-                        break
-            #TODO duplicated behavior consider for refactor
-            self.waypoints = self.gen_waypnts_arr[:]
-            # Current position is the first point of the path
-            self.__tar_gps == self.waypoints.pop(0)
-        else: self.gen_waypnts_arr = []
+    def gen_waypnts(self, gps_coors, alt=None, overlap=None):
+        """Using list of GPS coordinates outlining a field (any polygon,
+           vertices in order), calculates a back and forth route covering
+           it and populates waypoint list with results, see
+           coverage.boustrophedon."""
+        if not gps_coors: return True
+        if alt == None: alt = self.get_nav()["alt"]
+        if not alt >= self.__MIN_ALT: alt = self.__MIN_ALT
+        if overlap == None: overlap = self.__OVERLAP
+        spacing = coverage.pass_spacing(self.__CAM_FOV, alt, overlap)
+
+        # Plan in local meters, starting at the corner nearest the drone
+        vrts = np.array(gps_coors, float)
+        enu = geo.LocalProjection(vrts[0, 0], vrts[0, 1])
+        poly = np.column_stack(enu.to_local(vrts[:, 0], vrts[:, 1]))
+        here = enu.to_local(*list(self.get_nav()["gps"])[:2])
+        path = coverage.boustrophedon(poly, spacing, start=here)
+        lat, lon = enu.to_gps(path[:, 0], path[:, 1])
+
+        # Clear current waypoints and use new ones
+        self.waypoints.clear()
+        for waypoint in np.column_stack((lat, lon)).tolist():
+            self.waypoints.append(waypoint)
@@ -0,0 +1,138 @@
+"""Orders visits to many targets into a short open route.
+
+   Points are planar (east, north) meters, e.g. from geo.LocalProjection.
+   The route starts at a fixed start point and ends at whichever target
+   comes last. A nearest-neighbour route is improved by 2-opt (reversing
+   a stretch of the route) and Or-opt (moving 1-3 consecutive targets
+   elsewhere, either way round) until no move helps or the time budget
+   is spent. The budget only cuts the improvement short: the
+   nearest-neighbour route is always built in full. Each move is evaluated against all positions at once with
+   NumPy."""
+import time
+import numpy as np
+
+MATRIX_MAX = 2000 # Up to this many points, distances come from a matrix
+BUDGET_MIN = 2.0   # Default time budget (s), at least...
+BUDGET_PER_POINT = 0.002 # ...and this much per point, big routes need longer
+EPS = 1e-9        # Smallest improvement (m) that counts
+
+class _Distances:
+    """Distances from one point to many: rows of a precomputed matrix
+       for small problems, computed from coordinates for big ones."""
+
+    def __init__(self, xy):
+        self.xy = xy
+        self.matrix = None
+        if len(xy) <= MATRIX_MAX:
+            diff = xy[:, None, :] - xy[None, :, :]
+            self.matrix = np.sqrt((diff**2).sum(axis=2))
+
+    def to(self, a, idx):
+        if self.matrix is not None: return self.matrix[a, idx]
+        d = self.xy[idx] - self.xy[a]
+        return np.sqrt((d**2).sum(axis=-1))
+
+    def path(self, tour):
+        """Length of every leg of a route."""
+        d = np.diff(self.xy[tour], axis=0)
+        return np.sqrt((d**2).sum(axis=1))
+
+def _nearest_neighbour(dist, n):
+    """Greedy route from point 0 through points 1..n-1."""
+    tour = np.zeros(n, int)
+    left = np.ones(n, bool)
+    left[0] = False
+    everyone = np.arange(n)
+    for k in range(1, n):
+        d = dist.to(tour[k - 1], everyone)
+        d[~left] = np.inf
+        tour[k] = np.argmin(d)
+        left[tour[k]] = False
+    return tour
+
+def _two_opt(dist, tour, deadline):
+    """One pass of 2-opt over all route positions, returns whether the
+       route got shorter."""
+    n, improved = len(tour), False
+    for i in range(n - 2):
+        if time.time() > deadline: break
+        legs = np.append(dist.path(tour), 0.0) # legs[j]: tour[j] -> tour[j+1], none after the end
+        a, b = tour[i], tour[i + 1]
+        j = np.arange(i + 2, n)
+        # Replace legs a-b and c-d by a-c and b-d, the end has no d
+        after = np.append(dist.to(b, tour[j[:-1] + 1]), 0.0)
+        gain = legs[i] + legs[j] - dist.to(a, tour[j]) - after
+        best = np.argmax(gain)
+        if gain[best] > EPS:
+            k = j[best]
+            tour[i + 1:k + 1] = tour[i + 1:k + 1][::-1].copy()
+            improved = True
+    return tour, improved
+
+def _or_opt(dist, tour, deadline, max_len=3):
+    """One pass of Or-opt: every stretch of 1 to max_len targets is
+       tried at every other place, both ways round."""
+    improved = False
+    for length in range(1, max_len + 1):
+        i = 1
+        while i + length <= len(tour):
+            if time.time() > deadline: return tour, improved
+            n = len(tour)
+            first, last = tour[i], tour[i + length - 1]
+            prev = tour[i - 1]
+            has_next = i + length < n
+            nxt = tour[i + length] if has_next else None
+
+            # What taking the stretch out saves
+            saved = dist.to(prev, [first])[0]
+            if has_next:
+                saved += dist.to(last, [nxt])[0] - dist.to(prev, [nxt])[0]
+
+            # Cost of putting it between rest[j] and rest[j+1], or at the end
+            rest = np.concatenate((tour[:i], tour[i + length:]))
+            legs = np.append(dist.path(rest), 0.0)
+            following = np.append(rest[1:], -1)
+            inner = following >= 0
+            cost_fwd = dist.to(first, rest) - legs
+            cost_bwd = dist.to(last, rest) - legs
+            cost_fwd[inner] += dist.to(last, following[inner])
+            cost_bwd[inner] += dist.to(first, following[inner])
+            cost_fwd[i - 1] = cost_bwd[i - 1] = np.inf # Where it came from
+            j_fwd, j_bwd = np.argmin(cost_fwd), np.argmin(cost_bwd)
+
+            if saved - min(cost_fwd[j_fwd], cost_bwd[j_bwd]) > EPS:
+                stretch = tour[i:i + length]
+                if cost_bwd[j_bwd] < cost_fwd[j_fwd]: j, stretch = j_bwd, stretch[::-1]
+                else: j = j_fwd
+                tour = np.concatenate((rest[:j + 1], stretch, rest[j + 1:]))
+                improved = True
+            else: i += 1
+    return tour, improved
+
+def optimize(points, start, time_budget=None):
+    """Visiting order of points (N x 2) starting from start (x, y).
+       Returns (order, length): indices into points and route length.
+       time_budget (s, default growing with N) counts from the call but
+       only stops 2-opt/Or-opt; building the nearest-neighbour seed is
+       not interrupted, so with tens of thousands of points the call
+       can take longer than the budget."""
+    points = np.asarray(points, float).reshape(-1, 2)
+    if not len(points): return np.zeros(0, int), 0.0
+    if time_budget is None: time_budget = max(BUDGET_MIN, BUDGET_PER_POINT * len(points))
+    deadline = time.time() + time_budget
+    xy = np.vstack((np.asarray(start, float).reshape(1, 2), points))
+    dist = _Distances(xy)
+
+    tour = _nearest_neighbour(dist, len(xy))
+    improved = True
+    while improved and time.time() < deadline:
+        tour, improved = _two_opt(dist, tour, deadline)
+        tour, moved = _or_opt(dist, tour, deadline)
+        improved = improved or moved
+    return tour[1:] - 1, float(dist.path(tour).sum())
+
+def length(points, start, order):
+    """Length of the route from start through points in order."""
+    xy = np.vstack((np.asarray(start, float).reshape(1, 2),
+            np.asarray(points, float).reshape(-1, 2)[order]))
+    return float(np.sqrt((np.diff(xy, axis=0)**2).sum(axis=1)).sum())